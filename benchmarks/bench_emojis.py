@@ -0,0 +1,108 @@
+"""Сравнение format_text_with_emojis с прежним алгоритмом (по re.sub на ключ).
+
+Запуск: python benchmarks/bench_emojis.py [--lines 5000] [--repeat 3]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OWNER_ID", "0")
+
+import bot  # noqa: E402
+
+# Строки в духе ruRows реальных патчей dota1x6
+PATCH_LINES = [
+    "Урон <b>Spear of Mars</b> увеличен с 100/160/220/280 до 120/180/240/300",
+    "God's Rebuke теперь наносит дополнительный урон героям под действием Arena of Blood",
+    "Bulwark блокирует на 10% больше урона с фронта",
+    "Mana Break сжигает 4% от максимального запаса маны цели",
+    "Blink больше не прерывается при получении урона от крипов",
+    "Counterspell отражает Laguna Blade обратно в кастующего",
+    "Mana Void: урон за единицу недостающей маны уменьшен с 1.1 до 0.95",
+    "Время перезарядки Chemical Rage уменьшено на 10 секунд",
+    "Acid Spray теперь снижает броню на 2/3/4/5 и замедляет на 10%",
+    "Unstable Concoction взрывается через 5.5 секунд вместо 5",
+    "Greevil's Greed даёт на 2 золота больше за каждое убийство",
+    "Frost Arrows и Multishot теперь применяют Marksmanship",
+    "Gust отбрасывает врагов на 50 единиц дальше",
+    "Storm Bolt оглушает на 1.4/1.6/1.8/2.0 сек.",
+    "Warcry (cry) теперь даёт +2 к броне",
+    "God's Strength: бонус к урону уменьшен с 80% до 70%",
+    "Shadowraze накладывает дополнительный стак Necromastery",
+    "Requiem of Souls (requiem) выпускает 2 линии за каждую душу",
+    "Rot наносит 10 урона в секунду дополнительно; Flesh Heap даёт 1 силу за убийство",
+    "Dismember длится 3.3 секунды, Hook теперь проходит через деревья",
+    "Sand Storm невидимость длится на 1 секунду дольше, Burrowstrike оглушает дольше",
+    "Epicenter наносит на 15% больше урона по иллюзиям",
+    "Chain Frost подпрыгивает на 2 раза больше",
+    "Frostbite и Crystal Nova теперь замедляют на 20% скорость атаки",
+    "Phantom Strike увеличивает скорость атаки на 100",
+    "Coup de Grace: шанс крита уменьшен до 15%; Blur даёт 30% уклонения",
+    "Stifling Dagger наносит 70% урона от атаки",
+    "Omnislash: количество ударов 3/6/9, Blade Fury не даёт иммунитет к магии",
+    "Healing Ward восстанавливает 3% здоровья в секунду",
+    "Reincarnation: время перезарядки уменьшено с 200 до 160",
+    "Vampiric Aura даёт 15% вампиризма союзникам",
+    "Mystic Flare наносит 1000 урона, Arcane Bolt зависит от интеллекта",
+    "Concussive Shot замедляет на 40%, Ancient Seal усиливает магический урон",
+    "Scatterblast и Cookie теперь работают вместе с Lil' Shredder",
+    "Kisses (Firefly) ставит на землю горящие следы",
+    "Shrapnel: 5 зарядов, Headshot отбрасывает на 100 единиц, Take Aim: +100 дальности",
+    "Assassinate перезаряжается на 5 секунд быстрее",
+    "Hammer of Purity и Cleave теперь совместимы",
+    "Psi Blades (psiblades) проходят на 100 единиц дальше",
+    "Reflection и Meta теперь создают иллюзии (illusion)",
+    "Laser ослепляет на 4 секунды, March of the Machines выпускает больше роботов",
+    "Defense Matrix блокирует 200 урона, Rearm ускорен",
+    "Berserker's Call (call) длится 2.4 сек. Battle Hunger и Counter Helix без изменений",
+    "Culling Blade убивает героев с 300/450/625 здоровья",
+    "Movespeed бонус от Boots of Travel увеличен",
+    "Общее: золото за убийство крипов увеличено на 5%",
+    "Исправлена ошибка, из-за которой <i>таймер</i> не отображался",
+]
+
+
+def legacy_format_text_with_emojis(text):
+    if not isinstance(text, str):
+        return ""
+    text = re.sub(r'<[^>]+>', '', text)
+    keys = sorted(bot.SKILL_EMOJI_MAP.keys(), key=len, reverse=True)
+    return bot.annotate_sequential(text, keys, bot.SKILL_EMOJI_MAP)
+
+
+def run(func, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for line in lines:
+            func(line)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    lines = [PATCH_LINES[i % len(PATCH_LINES)] for i in range(args.lines)]
+
+    for line in PATCH_LINES:
+        assert legacy_format_text_with_emojis(line) == bot.format_text_with_emojis(line), line
+
+    legacy = run(legacy_format_text_with_emojis, lines, args.repeat)
+    current = run(bot.format_text_with_emojis, lines, args.repeat)
+
+    print(f"строк: {len(lines)}, ключей: {len(bot.SKILL_EMOJI_MAP)}")
+    print(f"прежний алгоритм: {legacy * 1000:.1f} мс ({legacy / len(lines) * 1e6:.1f} мкс/строка)")
+    print(f"один проход:      {current * 1000:.1f} мс ({current / len(lines) * 1e6:.1f} мкс/строка)")
+    print(f"ускорение: x{legacy / current:.1f}")
+
+
+if __name__ == "__main__":
+    main()
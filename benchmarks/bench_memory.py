@@ -0,0 +1,96 @@
+"""Память данных API, которые бот держит в памяти: сырые JSON против разобранных записей.
+
+Для каждого набора (история патчей, JSON героев, ладдер, список героев) через tracemalloc
+замеряется, сколько памяти остаётся занято после загрузки: сначала в виде dict/list,
+как их отдаёт json.loads, затем в виде записей bot.parse_* (сырой JSON после разбора
+отбрасывается). Данные — фикстуры из benchmarks/fixtures, размножённые до типичного объёма.
+
+Запуск: python benchmarks/bench_memory.py [--patches 20] [--heroes 125]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OWNER_ID", "0")
+
+import bot  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture_text(name):
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), encoding="utf-8") as f:
+        return f.read()
+
+
+def retained(build):
+    """Сколько байт остаётся выделено после build() (сам результат держим до конца замера)."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def build_sets(patches, heroes):
+    """Имя → (сырые данные, записи). Каждый элемент грузится отдельным json.loads, как из API."""
+    patch_text = fixture_text("patch_large")
+    hero_text = fixture_text("hero_heavy")
+    leaderboard_text = fixture_text("leaderboard_full")
+    heroes_text = json.dumps({"data": {"heroes": [
+        {"name": f"npc_dota_hero_{i}", "userFriendlyName": f"Hero {i}", "attribute": ["Strength", "Agility", "Intellect", "All"][i % 4]}
+        for i in range(heroes)
+    ]}})
+
+    return {
+        f"история патчей ({patches})": (
+            lambda: [json.loads(patch_text) for _ in range(patches)],
+            lambda: [bot.parse_patch(json.loads(patch_text)) for _ in range(patches)],
+        ),
+        f"JSON героев ({heroes})": (
+            lambda: [json.loads(hero_text) for _ in range(heroes)],
+            lambda: [bot.parse_hero_details(json.loads(hero_text)) for _ in range(heroes)],
+        ),
+        "ладдер": (
+            lambda: json.loads(leaderboard_text),
+            lambda: [bot.parse_ladder_player(player) for player in json.loads(leaderboard_text)["data"]],
+        ),
+        f"список героев ({heroes})": (
+            lambda: json.loads(heroes_text),
+            lambda: bot.parse_heroes(json.loads(heroes_text)),
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patches", type=int, default=20, help="патчей в истории")
+    parser.add_argument("--heroes", type=int, default=125, help="героев в кэше")
+    args = parser.parse_args()
+
+    # прогрев: интернированные строки и кэши модуля не должны попасть в замер
+    for raw, records in build_sets(1, 1).values():
+        raw()
+        records()
+
+    print(f"{'набор':<28}{'JSON КБ':>10}{'записи КБ':>12}{'экономия':>10}")
+    total_raw = total_records = 0
+    for name, (raw, records) in build_sets(args.patches, args.heroes).items():
+        raw_size = retained(raw)
+        records_size = retained(records)
+        total_raw += raw_size
+        total_records += records_size
+        print(f"{name:<28}{raw_size / 1024:>10.0f}{records_size / 1024:>12.0f}{1 - records_size / raw_size:>10.0%}")
+    print(f"{'всего':<28}{total_raw / 1024:>10.0f}{total_records / 1024:>12.0f}{1 - total_records / total_raw:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Бенчмарк горячих путей рендера на записанных фикстурах (benchmarks/fixtures).
+
+Для каждой функции: пропускная способность, задержки p50/p95/p99 и память одного вызова
+через tracemalloc (пик и число блоков, оставшихся после вызова). Результат сравнивается с
+сохранённым базовым замером по лучшему времени вызова (оно меньше всего зависит от
+шума машины); при замедлении больше чем в --max-regression раз скрипт завершается
+с кодом 1, чтобы регрессия была видна до деплоя.
+
+Базовый замер может быть снят на другой машине: вызовы функции чередуются с
+калибровочным циклом на чистом Python, и сравниваются времена в его единицах, а не
+миллисекунды. Замедление перепроверяется повторными замерами (--confirm), чтобы
+разовый всплеск нагрузки на машине не валил проверку. Базовый замер без калибровки
+сравнивается по абсолютному времени — это верно только на той же машине.
+
+Запуск:
+    python benchmarks/bench_render.py                  # замер и сравнение с baseline.json
+    python benchmarks/bench_render.py --save-baseline  # записать новый базовый замер
+    python benchmarks/bench_render.py --only patch     # только функции с "patch" в имени
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OWNER_ID", "0")
+
+import bot  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_cases():
+    """Имя → (функция без аргументов, сколько вызовов на один прогон)."""
+    patch = load_fixture("patch_large")
+    hero_json = load_fixture("hero_heavy")
+    leaderboard = load_fixture("leaderboard_full")
+
+    lines = [line.strip() for line in patch["ruRows"].split("\n") if line.strip()]
+    for hero in patch["heroes"]:
+        lines += [line.strip() for line in hero.get("ruRows", "").split("\n") if line.strip()]
+    formatted = [bot.format_text_with_emojis(line) for line in lines]
+    patch_record = bot.parse_patch(patch)
+    hero = bot.parse_hero_details(hero_json)
+    patch_text = "".join(bot.iter_update_sections(patch_record))
+
+    def emojis():
+        for line in lines:
+            bot.format_text_with_emojis(line)
+
+    def escape():
+        for line in formatted:
+            bot.escape_markdown_v2(line)
+
+    return {
+        "format_text_with_emojis": (emojis, 30),
+        "escape_markdown_v2": (escape, 30),
+        "patch_parse": (lambda: bot.parse_patch(patch), 50),
+        "patch_sections": (lambda: list(bot.iter_update_sections(patch_record)), 20),
+        "patch_pack": (lambda: bot.pack_markdown_v2(patch_text), 20),
+        "patch_messages": (lambda: bot.render_patch_messages(patch_record), 20),
+        "hero_parse": (lambda: bot.parse_hero_details(hero_json), 200),
+        "hero_messages": (lambda: bot.render_hero_messages(hero), 50),
+        "ladder_snapshot": (lambda: bot.LadderSnapshot(leaderboard, bot.LEADERBOARD_PAGE_SIZE), 20),
+    }
+
+
+CALIBRATION_TEXT = "Урон +15% к способности, 250/300/350 ед. Перезарядка: 12 сек. " * 40
+CALIBRATION_RE = re.compile(r"[\w%+]+|\d+")
+
+
+def calibration_work():
+    """Работа того же рода, что у рендера: регулярки, словари, сборка строк."""
+    for _ in range(10):
+        counts = {}
+        for word in CALIBRATION_RE.findall(CALIBRATION_TEXT):
+            counts[word] = counts.get(word, 0) + 1
+        "".join(f"{word}:{count}" for word, count in sorted(counts.items()))
+
+
+def measure(func, repeat):
+    func()  # прогрев: скомпилированные регулярки, кэши
+    calibration_work()
+    samples = []
+    calibration = []
+    # Вперемешку с калибровкой: оба замера попадают под одну и ту же нагрузку на машину
+    for _ in range(repeat):
+        started = time.perf_counter()
+        calibration_work()
+        calibration.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+    return {
+        "min_ms": samples[0] * 1000,
+        "p50_ms": pick(0.50) * 1000,
+        "p95_ms": pick(0.95) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "per_sec": 1 / (sum(samples) / len(samples)),
+        "peak_kb": peak / 1024,
+        "retained_blocks": retained,
+        "calibration_ms": min(calibration) * 1000,
+    }
+
+
+def slowdown(result, base):
+    """Во сколько раз лучшее время медленнее базового, в единицах калибровки, если она есть у обоих."""
+    value = result["min_ms"] / base["min_ms"]
+    if base.get("calibration_ms"):
+        value /= result["calibration_ms"] / base["calibration_ms"]
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat-scale", type=float, default=1.0, help="множитель числа повторов")
+    parser.add_argument("--only", default="", help="подстрока имени функции")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--max-regression", type=float, default=1.25, help="допустимое замедление лучшего времени")
+    parser.add_argument("--confirm", type=int, default=2, help="повторных замеров перед тем, как признать замедление")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+    if baseline and not all(result.get("calibration_ms") for result in baseline.values()):
+        print("В базовом замере нет калибровки: сравнение по абсолютному времени верно только на той же машине")
+
+    results = {}
+    regressions = []
+    print(f"{'функция':<24}{'мин мс':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'выз/с':>9}{'пик КБ':>9}{'блоков':>9}  к базе")
+    for name, (func, repeat) in build_cases().items():
+        if args.only not in name:
+            continue
+        repeat = max(3, int(repeat * args.repeat_scale))
+        result = measure(func, repeat)
+        ratio = ""
+        base = baseline.get(name, {})
+        if base.get("min_ms"):
+            value = slowdown(result, base)
+            for _ in range(args.confirm):
+                if value <= args.max_regression:
+                    break
+                retry = measure(func, repeat)
+                retry_value = slowdown(retry, base)
+                if retry_value < value:
+                    result, value = retry, retry_value
+            ratio = f"x{value:.2f}"
+            if value > args.max_regression:
+                ratio += " РЕГРЕССИЯ"
+                regressions.append(name)
+        results[name] = result
+        print(
+            f"{name:<24}{result['min_ms']:>9.2f}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+            f"{result['per_sec']:>9.1f}{result['peak_kb']:>9.0f}{result['retained_blocks']:>9}  {ratio}"
+        )
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Базовый замер сохранён: {BASELINE_FILE}")
+    elif regressions:
+        print(f"Замедление больше чем в {args.max_regression} раза: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Задержка цикла событий при рендере большого патча: inline, thread и process.
+
+Пока рендерится патч, отдельная задача раз в --tick мс просыпается и замеряет,
+насколько она опоздала, — столько же ждали бы ответа пользователи из других чатов.
+
+Запуск: python benchmarks/bench_render_offload.py [--heroes 400] [--tick 5]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OWNER_ID", "0")
+
+import bot  # noqa: E402
+from bench_emojis import PATCH_LINES  # noqa: E402
+
+
+def make_patch(heroes, seed=1):
+    rnd = random.Random(seed)
+
+    def rows(count):
+        return "\n".join(rnd.choice(PATCH_LINES) for _ in range(count))
+
+    return {
+        "ruName": "Синтетический патч",
+        "ruRows": rows(20),
+        "items": [{"name": f"item_{i}", "ruRows": rows(3), "changeType": "Up"} for i in range(30)],
+        "heroes": [
+            {
+                "userFriendlyName": f"Hero {i}",
+                "ruRows": rows(5),
+                "changeType": "Change",
+                "upgrades": [{"type": "scepter", "ruRows": rows(2), "changeType": "Up"}],
+                "talents": [{"name": "hero_talent", "orangeRuRows": rows(2), "changeType": "Down"}],
+            }
+            for i in range(heroes)
+        ],
+    }
+
+
+async def run_mode(mode, patch, tick):
+    pool = bot.RenderPool(mode, bot.RENDER_WORKERS, bot.RENDER_QUEUE_SIZE)
+    pool.start()
+    bot.RENDER_POOL = pool
+    bot.RENDERED_UPDATES.clear()
+
+    async def fake_fetch(url):
+        return {"data": patch}
+    bot.fetch_json = fake_fetch
+
+    # прогрев пула (запуск процессов не должен попасть в замер)
+    await pool.run(bot.render_update_batch, [])
+
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(tick)
+            lags.append(time.perf_counter() - started - tick)
+
+    ticker_task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    messages = await bot.get_update_messages("bench")
+    total = time.perf_counter() - started
+    done.set()
+    await ticker_task
+    pool.stop()
+
+    lags.sort()
+    pick = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))] * 1000
+    print(
+        f"{mode:>8}: сообщений {len(messages)}, рендер {total * 1000:.0f} мс, "
+        f"задержка цикла p50={pick(0.5):.1f} p99={pick(0.99):.1f} max={lags[-1] * 1000:.1f} мс"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--heroes", type=int, default=400)
+    parser.add_argument("--tick", type=float, default=5, help="период замера, мс")
+    args = parser.parse_args()
+
+    patch = make_patch(args.heroes)
+    for mode in ("inline", "thread", "process"):
+        asyncio.run(run_mode(mode, patch, args.tick / 1000))
+
+
+if __name__ == "__main__":
+    main()
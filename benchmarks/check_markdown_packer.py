@@ -0,0 +1,165 @@
+"""Проверка bot.MarkdownV2Packer на случайных текстах при маленьких лимитах.
+
+Генерирует MarkdownV2 с вложенными сущностями (жирный, курсив, подчёркнутый,
+зачёркнутый, спойлер), экранированием, code/pre, ссылками, кириллицей и эмодзи
+(два символа UTF-16), режет через bot.pack_markdown_v2 и разбирает каждое сообщение
+отдельным парсером. Для каждого сообщения проверяется, что сущности сбалансированы
+и правильно вложены, служебные символы экранированы, а видимая длина не больше лимита;
+для текста целиком — что видимое содержимое сообщений совпадает с исходным.
+
+Запуск: python benchmarks/check_markdown_packer.py [--cases 3000] [--seed 1]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OWNER_ID", "0")
+
+import bot  # noqa: E402
+
+MARKS = ["*", "_", "__", "~", "||"]
+SPECIAL = "_*[]()~`>#+-=|{}.!"
+WORDS = ["патч", "герой", "Strength", "x", "урон+15%", "(1.2)", "a_b", "😀", "👍🏻", "v7.35c!", "длинноеслово" * 3]
+
+
+def escape(text):
+    return "".join("\\" + ch if ch in SPECIAL or ch == "\\" else ch for ch in text)
+
+
+def gen_text(rng):
+    """Непустой обычный текст: (разметка, видимый текст)."""
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, 4))]
+    visible = ""
+    for word in words:
+        visible += word + rng.choice([" ", " ", "\n", ""])
+    return escape(visible), visible
+
+
+def gen_code(rng):
+    # код из одних пробелов Telegram отклонит и сам по себе, поэтому в теле всегда есть видимый символ
+    body = rng.choice(["a", "б", "😀"]) + "".join(
+        rng.choice(["a", "б", " ", "*", "_", "[", "`", "\\", "😀"]) for _ in range(rng.randint(0, 60))
+    )
+    markup = body.replace("\\", "\\\\").replace("`", "\\`")
+    fence = rng.choice(["`", "```"])
+    return fence + markup + fence, body
+
+
+def gen_link(rng, outer):
+    text_markup, text_visible = gen_text(rng)
+    if "*" not in outer and rng.random() < 0.3:
+        text_markup = f"*{text_markup}*"
+    return f"[{text_markup}](https://example.com/{rng.randint(1, 999)}\\))", text_visible
+
+
+def gen_nodes(rng, depth, outer):
+    """Последовательность узлов; между любыми двумя сущностями и по краям — обычный текст,
+    чтобы во входе не было неоднозначных "___"."""
+    markup, visible = gen_text(rng)
+    for _ in range(rng.randint(0, 3)):
+        kind = rng.random()
+        free_marks = [mark for mark in MARKS if mark not in outer]
+        if kind < 0.5 and depth < 4 and free_marks:
+            mark = rng.choice(free_marks)
+            inner_markup, inner_visible = gen_nodes(rng, depth + 1, outer + [mark])
+            node = (mark + inner_markup + mark, inner_visible)
+        elif kind < 0.75:
+            node = gen_code(rng)
+        else:
+            node = gen_link(rng, outer)
+        text = gen_text(rng)
+        markup += node[0] + text[0]
+        visible += node[1] + text[1]
+    return markup, visible
+
+
+def parse(text):
+    """Видимый текст сообщения MarkdownV2; AssertionError, если Telegram его не примет."""
+    out = []
+    stack = []
+    i = 0
+
+    def read_until(start, end):
+        chars = []
+        k = start
+        while not text.startswith(end, k):
+            assert k < len(text), f"не закрыт {end!r}"
+            if text[k] == "\\":
+                chars.append(text[k + 1])
+                k += 2
+            else:
+                chars.append(text[k])
+                k += 1
+        return "".join(chars), k + len(end)
+
+    while i < len(text):
+        ch = text[i]
+        if ch == "\r":
+            i += 1
+        elif ch == "\\":
+            assert i + 1 < len(text), "обратный слэш в конце сообщения"
+            out.append(text[i + 1])
+            i += 2
+        elif text.startswith("```", i) or ch == "`":
+            fence = "```" if text.startswith("```", i) else "`"
+            body, i = read_until(i + len(fence), fence)
+            out.append(body)
+        elif ch == "[":
+            start = i
+            _, end = read_until(i + 1, "]")
+            assert text.startswith("(", end), "у ссылки нет адреса"
+            _, i = read_until(end + 1, ")")
+            out.append(parse(text[start + 1:end - 1]))
+        elif text.startswith("||", i) or text.startswith("__", i) or ch in "*_~":
+            mark = text[i:i + 2] if text.startswith(("||", "__"), i) else ch
+            if stack and stack[-1] == mark:
+                stack.pop()
+            else:
+                assert mark not in stack, f"сущности {stack} закрываются не по порядку: {mark!r}"
+                stack.append(mark)
+            i += len(mark)
+        else:
+            assert ch not in SPECIAL, f"неэкранированный {ch!r}"
+            out.append(ch)
+            i += 1
+    assert not stack, f"не закрыты сущности {stack}"
+    return "".join(out)
+
+
+def squeeze(text):
+    return re.sub(r"\s+", "", text)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=3000, help="случайных текстов")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = 0
+    for case in range(args.cases):
+        markup, visible = gen_nodes(rng, 0, [])
+        assert squeeze(parse(markup)) == squeeze(visible), f"ошибка генератора: {markup!r}"
+        limit = rng.randint(20, 200)
+        chunks = bot.pack_markdown_v2(markup, limit)
+        try:
+            content = ""
+            for chunk in chunks:
+                chunk_visible = parse(chunk)
+                assert squeeze(chunk_visible), f"пустое сообщение {chunk!r}"
+                assert bot.utf16_len(chunk_visible) <= limit, f"видимая длина {bot.utf16_len(chunk_visible)} > {limit}: {chunk!r}"
+                content += chunk_visible
+            assert squeeze(content) == squeeze(visible), "видимое содержимое потеряно или изменено"
+        except AssertionError as e:
+            print(f"случай {case}, лимит {limit}: {e}\nвход: {markup!r}\nсообщения: {chunks!r}")
+            sys.exit(1)
+        messages += len(chunks)
+    print(f"ok: {args.cases} текстов, {messages} сообщений")
+
+
+if __name__ == "__main__":
+    main()
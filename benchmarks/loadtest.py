@@ -0,0 +1,390 @@
+"""Сквозной нагрузочный тест bot.py с локальными заглушками Telegram Bot API и API dota1x6.
+
+Скрипт поднимает две заглушки и запускает настоящий bot.py (main(), режим polling):
+  * фейковый Bot API отдаёт синтетические Update через getUpdates и принимает
+    sendMessage/editMessageText/answerCallbackQuery и прочие вызовы;
+  * фейковый stats/CDN отвечает фикстурами из benchmarks/fixtures с заданной задержкой
+    и долей ошибок 503.
+Обновления подаются с заданной частотой (открытая модель нагрузки), у каждого свой чат,
+поэтому все вызовы Bot API однозначно относятся к своему обновлению.
+
+Отчёт: обработано обновлений в секунду, задержка от выдачи обновления боту до первого
+и последнего ответа (p50/p99) по сценариям, число запросов к API и задержка цикла событий
+(из /metrics самого бота).
+
+Запуск: python benchmarks/loadtest.py [--rate 20] [--duration 30] [--upstream-latency 50]
+                                      [--upstream-errors 0.0] [--telegram-limits]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from aiohttp import web, ClientSession
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_FILE = os.path.join(os.path.dirname(BENCH_DIR), "bot.py")
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+BOT_TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Load", "username": "loadtest_bot"}
+
+# Сценарий → (доля в нагрузке, как собрать Update)
+SCENARIOS = {
+    "start": 0.15,
+    "updates": 0.15,
+    "ladder": 0.15,
+    "ladder_page": 0.10,
+    "heroes": 0.10,
+    "hero": 0.15,
+    "stats": 0.10,
+    "inline": 0.10,
+}
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ---------- Заглушка API dota1x6 ----------
+class FakeStatsApi:
+    """stats.dota1x6.com и cdn.dota1x6.com на одном порту."""
+
+    def __init__(self, latency, errors, seed=1):
+        self.latency = latency
+        self.errors = errors
+        self.rnd = random.Random(seed)
+        self.calls = defaultdict(int)
+        self.patch = load_fixture("patch_large")
+        self.hero_json = load_fixture("hero_heavy")
+        self.leaderboard = load_fixture("leaderboard_full")
+        self.hero_names = [f"hero_{i}" for i in range(40)]
+        self.heroes = {
+            "data": {
+                "heroes": [
+                    {"name": name, "userFriendlyName": f"Hero {i}", "attribute": ["Strength", "Agility", "Intellect", "All"][i % 4]}
+                    for i, name in enumerate(self.hero_names)
+                ]
+            }
+        }
+        self.updates = {"data": {"values": [{"url": f"patch-{i}"} for i in range(20, 0, -1)]}}
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/api/v2/updates/", self.updates_list)
+        app.router.add_get("/api/v2/updates/{slug}", self.update_details)
+        app.router.add_get("/api/v2/heroes/", self.heroes_list)
+        app.router.add_get("/api/v2/leaderboard/", self.leaderboard_list)
+        app.router.add_get("/api/v2/players/steam-profile", self.steam_profile)
+        app.router.add_get("/api/v2/players/", self.player)
+        app.router.add_get("/shared/{file}", self.hero_file)
+        return app
+
+    async def _respond(self, kind, payload):
+        self.calls[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.rnd.expovariate(1 / self.latency))
+        if self.errors and self.rnd.random() < self.errors:
+            self.calls[f"{kind}_503"] += 1
+            return web.Response(status=503)
+        return web.json_response(payload)
+
+    async def updates_list(self, request):
+        return await self._respond("updates", self.updates)
+
+    async def update_details(self, request):
+        patch = dict(self.patch, ruName=f"Обновление {request.match_info['slug']}")
+        return await self._respond("update_details", {"data": patch})
+
+    async def heroes_list(self, request):
+        return await self._respond("heroes", self.heroes)
+
+    async def leaderboard_list(self, request):
+        return await self._respond("leaderboard", self.leaderboard)
+
+    async def player(self, request):
+        player_id = int(request.query.get("playerId", "0"))
+        return await self._respond("players", {"data": {
+            "matchCount": player_id % 900, "avgPlace": 3.5, "firstPlaces": player_id % 50, "rating": 5000 + player_id % 3000,
+            "favoriteHero": "npc_dota_hero_pudge", "social": None,
+        }})
+
+    async def steam_profile(self, request):
+        return await self._respond("steam_profile", {"data": {"personaname": f"player{request.query.get('playerId')}"}})
+
+    async def hero_file(self, request):
+        return await self._respond("hero_json", self.hero_json)
+
+
+# ---------- Заглушка Telegram Bot API ----------
+class FakeBotApi:
+    """Очередь синтетических Update для getUpdates и журнал ответов бота по ключу обновления."""
+
+    def __init__(self):
+        self.queue = []
+        self.offset = 0
+        self.new_updates = asyncio.Event()
+        self.polling = asyncio.Event()
+        self.delivered_at = {}
+        self.responses = defaultdict(list)
+        self.methods = defaultdict(int)
+        self.message_ids = itertools.count(1000)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def push(self, update):
+        self.queue.append(update)
+        self.new_updates.set()
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.methods[method] += 1
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+
+        now = time.perf_counter()
+        key = params.get("chat_id") or params.get("inline_query_id") or params.get("callback_query_id")
+        if key is not None:
+            self.responses[str(key)].append((now, method))
+        if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            chat_id = int(params.get("chat_id", 0))
+            return self._ok({
+                "message_id": int(params.get("message_id") or next(self.message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            })
+        return self._ok(True)
+
+    async def _get_updates(self, params):
+        self.polling.set()
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self.queue = [update for update in self.queue if update["update_id"] >= offset]
+        if not self.queue:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout=min(float(params.get("timeout") or 0), 1.0))
+            except asyncio.TimeoutError:
+                pass
+        batch = self.queue[:int(params.get("limit") or 100)]
+        now = time.perf_counter()
+        for update in batch:
+            self.delivered_at.setdefault(update["update_id"], now)
+        return batch
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({"ok": True, "result": result})
+
+
+# ---------- Генератор нагрузки ----------
+def make_update(update_id, scenario, rnd):
+    """Update для сценария. Чат у каждого обновления свой: chat_id = update_id."""
+    user = {"id": update_id, "is_bot": False, "first_name": f"User{update_id}"}
+    chat = {"id": update_id, "type": "private"}
+
+    def message(text):
+        entities = []
+        if text.startswith("/"):
+            entities.append({"type": "bot_command", "offset": 0, "length": len(text.split()[0])})
+        return {"update_id": update_id, "message": {
+            "message_id": 1, "date": int(time.time()), "chat": chat, "from": user, "text": text, "entities": entities,
+        }}
+
+    if scenario == "start":
+        return message("/start")
+    if scenario == "updates":
+        return message("Обновления")
+    if scenario == "ladder":
+        return message("Ладдер")
+    if scenario == "heroes":
+        return message("Герои")
+    if scenario == "hero":
+        return message(f"/hero hero {rnd.randint(0, 39)}")
+    if scenario == "stats":
+        return message("/stats " + " ".join(str(rnd.randint(10000, 99999)) for _ in range(rnd.randint(1, 5))))
+    if scenario == "ladder_page":
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": "load", "data": f"ladder_page_{rnd.randint(1, 10)}",
+            "message": {"message_id": 1, "date": int(time.time()), "chat": chat, "from": BOT_USER, "text": "ЛАДДЕР"},
+        }}
+    return {"update_id": update_id, "inline_query": {
+        "id": str(update_id), "from": user, "query": rnd.choice(["her", "hero 1", "hero 2", "h"]), "offset": "",
+    }}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def parse_prometheus(text):
+    """{(метрика, {метки}): значение} из текстового формата Prometheus."""
+    result = {}
+    for line in text.splitlines():
+        match = re.match(r'^(\w+)\{(.*)\} ([\d.eE+-]+)$', line)
+        if match:
+            labels = tuple(sorted(re.findall(r'(\w+)="([^"]*)"', match.group(2))))
+            result[(match.group(1), labels)] = float(match.group(3))
+    return result
+
+
+async def run(args):
+    rnd = random.Random(args.seed)
+    stats_api = FakeStatsApi(args.upstream_latency / 1000, args.upstream_errors, args.seed)
+    bot_api = FakeBotApi()
+
+    runners = []
+    for app, port in ((bot_api.app(), args.telegram_port), (stats_api.app(), args.stats_port)):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        runners.append(runner)
+
+    workdir = tempfile.mkdtemp(prefix="bot-loadtest-")
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BOT_TOKEN,
+        OWNER_ID="1",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{args.telegram_port}",
+        STATS_API_BASE=f"http://127.0.0.1:{args.stats_port}",
+        CDN_BASE=f"http://127.0.0.1:{args.stats_port}",
+        METRICS_PORT=str(args.metrics_port),
+        SNAPSHOT_FILE="",
+        SUBSCRIBERS_FILE=os.path.join(workdir, "subscribers.json"),
+        HERO_CACHE_DIR=os.path.join(workdir, "hero_cache"),
+        PATCH_WATCH_INTERVAL="3600",
+    )
+    if not args.telegram_limits:
+        # Иначе пропускную способность ограничат лимиты Telegram, а не сам процесс
+        env.update(SEND_GLOBAL_RATE="100000", SEND_GLOBAL_BURST="100000", SEND_CHAT_RATE="1000", SEND_CHAT_BURST="1000")
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, BOT_FILE, cwd=workdir, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=None if args.verbose else asyncio.subprocess.DEVNULL,
+    )
+
+    try:
+        await asyncio.wait_for(bot_api.polling.wait(), timeout=30)
+        scenarios, weights = zip(*SCENARIOS.items())
+        sent = {}
+        started = time.perf_counter()
+        interval = 1 / args.rate
+        for i in range(int(args.rate * args.duration)):
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            update_id = i + 1
+            scenario = rnd.choices(scenarios, weights)[0]
+            sent[update_id] = scenario
+            bot_api.push(make_update(update_id, scenario, rnd))
+        injected = time.perf_counter() - started
+
+        # Ждём, пока бот перестанет отвечать (или истечёт время на дообработку)
+        last_count, quiet_since = -1, time.perf_counter()
+        while time.perf_counter() - quiet_since < 2 and time.perf_counter() - started < args.duration + args.drain:
+            count = sum(len(calls) for calls in bot_api.responses.values())
+            if count != last_count:
+                last_count, quiet_since = count, time.perf_counter()
+            await asyncio.sleep(0.2)
+
+        async with ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{args.metrics_port}/metrics") as response:
+                metrics = parse_prometheus(await response.text())
+    finally:
+        process.terminate()
+        await process.wait()
+        for runner in runners:
+            await runner.cleanup()
+
+    report(args, sent, bot_api, stats_api, metrics, started, injected)
+
+
+def report(args, sent, bot_api, stats_api, metrics, started, injected):
+    first = defaultdict(list)
+    last = defaultdict(list)
+    handled = 0
+    finished_at = started
+    for update_id, scenario in sent.items():
+        calls = bot_api.responses.get(str(update_id))
+        delivered = bot_api.delivered_at.get(update_id)
+        if not calls or delivered is None:
+            continue
+        handled += 1
+        finished_at = max(finished_at, calls[-1][0])
+        first[scenario].append(calls[0][0] - delivered)
+        last[scenario].append(calls[-1][0] - delivered)
+
+    elapsed = finished_at - started
+    print(f"Подано {len(sent)} обновлений за {injected:.1f} с (цель {args.rate}/с), обработано {handled}")
+    print(f"Пропускная способность: {handled / elapsed if elapsed else 0:.1f} обновлений/с")
+    print(f"{'сценарий':<12}{'n':>6}{'1-й p50':>10}{'1-й p99':>10}{'посл p50':>10}{'посл p99':>10}  (мс)")
+    all_first, all_last = [], []
+    for scenario in SCENARIOS:
+        all_first += first[scenario]
+        all_last += last[scenario]
+        print(
+            f"{scenario:<12}{len(last[scenario]):>6}"
+            f"{percentile(first[scenario], 0.5) * 1000:>10.0f}{percentile(first[scenario], 0.99) * 1000:>10.0f}"
+            f"{percentile(last[scenario], 0.5) * 1000:>10.0f}{percentile(last[scenario], 0.99) * 1000:>10.0f}"
+        )
+    print(
+        f"{'всего':<12}{len(all_last):>6}"
+        f"{percentile(all_first, 0.5) * 1000:>10.0f}{percentile(all_first, 0.99) * 1000:>10.0f}"
+        f"{percentile(all_last, 0.5) * 1000:>10.0f}{percentile(all_last, 0.99) * 1000:>10.0f}"
+    )
+
+    print("Запросы к API dota1x6: " + ", ".join(f"{kind}={count}" for kind, count in sorted(stats_api.calls.items())))
+    print("Вызовы Bot API: " + ", ".join(f"{method}={count}" for method, count in sorted(bot_api.methods.items())))
+    latency = defaultdict(dict)
+    for (name, labels), value in metrics.items():
+        labels = dict(labels)
+        if name == "bot_latency_seconds":
+            latency[(labels["kind"], labels["name"])][labels["quantile"]] = value
+        elif name == "bot_requests_total":
+            latency[(labels["kind"], labels["name"])]["n"] = value
+    for (kind, name), values in sorted(latency.items()):
+        if kind == "upstream":
+            print(
+                f"Запросы бота к {name}: n={values.get('n', 0):.0f} "
+                f"p50={values.get('0.5', 0) * 1000:.0f} мс p99={values.get('0.99', 0) * 1000:.0f} мс"
+            )
+    lag = latency.get(("loop", "lag"))
+    if lag:
+        print(f"Задержка цикла событий: p50={lag.get('0.5', 0) * 1000:.1f} мс, p99={lag.get('0.99', 0) * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=20, help="обновлений в секунду")
+    parser.add_argument("--duration", type=float, default=30, help="секунд подачи нагрузки")
+    parser.add_argument("--drain", type=float, default=60, help="сколько ещё ждать дообработки, с")
+    parser.add_argument("--upstream-latency", type=float, default=50, help="средняя задержка API dota1x6, мс")
+    parser.add_argument("--upstream-errors", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--telegram-limits", action="store_true", help="оставить лимиты отправки Telegram")
+    parser.add_argument("--telegram-port", type=int, default=18081)
+    parser.add_argument("--stats-port", type=int, default=18082)
+    parser.add_argument("--metrics-port", type=int, default=18083)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="показывать лог бота")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Фикстуры для benchmarks/bench_render.py.
+
+По умолчанию генерирует детерминированные данные в формате ответов API dota1x6:
+большой патч, «тяжёлый» JSON героя и полный ладдер. С --record скачивает
+настоящие ответы (нужен доступ к stats.dota1x6.com и cdn.dota1x6.com).
+
+Запуск: python benchmarks/make_fixtures.py [--record] [--hero pudge] [--update <slug>]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OWNER_ID", "0")
+
+import bot  # noqa: E402
+from bench_emojis import PATCH_LINES  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SKILLS = sorted(bot.SKILL_EMOJI_MAP)
+
+
+def rows(rnd, count):
+    return "\n".join(rnd.choice(PATCH_LINES) for _ in range(count))
+
+
+def make_patch(rnd, heroes=80, items=40):
+    def talent():
+        color = rnd.choice(["orangeRuRows", "purpleRuRows", "blueRuRows"])
+        return {
+            "name": rnd.choice(SKILLS + ["hero_talent"]),
+            "changeType": rnd.choice(["Up", "Down", "Change"]),
+            "abilityRuRows": rows(rnd, 1),
+            color: rows(rnd, rnd.randint(1, 3)),
+        }
+
+    return {
+        "ruName": "Обновление 7.37 1x6",
+        "changeType": "Change",
+        "ruRows": rows(rnd, 25),
+        "items": [
+            {"name": f"item_{rnd.choice(SKILLS)}_{i}", "changeType": rnd.choice(["Up", "Down"]), "ruRows": rows(rnd, 3)}
+            for i in range(items)
+        ],
+        "heroes": [
+            {
+                "userFriendlyName": f"Hero {i}",
+                "changeType": rnd.choice(["Up", "Down", "Change"]),
+                "ruRows": rows(rnd, rnd.randint(2, 8)),
+                "upgrades": [
+                    {"type": kind, "changeType": "Up", "ruRows": rows(rnd, 2)}
+                    for kind in ("scepter", "shard") if rnd.random() < 0.6
+                ],
+                "talents": [talent() for _ in range(rnd.randint(1, 5))],
+            }
+            for i in range(heroes)
+        ],
+    }
+
+
+def make_hero(rnd):
+    def talents():
+        return {
+            skill: [{"description": rows(rnd, 2)} for _ in range(4)]
+            for skill in rnd.sample(SKILLS, 5)
+        }
+
+    return {
+        "userFriendlyName": "Pudge",
+        "changes": [{"name": "innate", "description": rows(rnd, 2)}]
+        + [{"name": rnd.choice(SKILLS), "description": rows(rnd, 3)} for _ in range(25)],
+        "upgrades": [
+            {
+                "upgradeType": kind,
+                "description": rows(rnd, 2),
+                "extraValues": [[rnd.choice(SKILLS), str(rnd.randint(1, 500))] for _ in range(3)],
+            }
+            for kind in ("scepter", "scepter", "shard")
+        ],
+        "purpleTalents": talents(),
+        "blueTalents": talents(),
+        "orangeTalents": talents(),
+    }
+
+
+def make_leaderboard(rnd, players=1000):
+    data = []
+    for place in range(1, players + 1):
+        social = None
+        if rnd.random() < 0.2:
+            social = {
+                "youtube": f"https://youtube.com/@player{place}",
+                "twitch": f"https://twitch.tv/player_{place}" if rnd.random() < 0.5 else None,
+                "isYoutubeLive": rnd.random() < 0.1,
+                "isTwitchLive": rnd.random() < 0.1,
+            }
+        data.append({
+            "place": place,
+            "nickname": f"[1x6] player_{place}.{rnd.choice(['ru', 'ua', 'kz'])}",
+            "rating": 9000 - place * 5,
+            "matchCount": rnd.randint(50, 5000),
+            "favoriteHero": f"npc_dota_hero_{rnd.choice(SKILLS)}",
+            "social": social,
+        })
+    return {"data": data}
+
+
+async def record(hero, update_slug):
+    try:
+        if not update_slug:
+            updates = await bot.fetch_json_uncached(bot.API_UPDATES_URL)
+            update_slug = updates["data"]["values"][0]["url"]
+        patch = await bot.fetch_json_uncached(f"{bot.API_UPDATE_DETAILS_URL}{update_slug}")
+        hero_json = await bot.fetch_json_uncached(f"{bot.CDN_HEROES_INFO_URL}ru_{hero}.json")
+        leaderboard = await bot.fetch_json_uncached(bot.API_LEADERBOARD_URL)
+    finally:
+        await bot.close_http_session()
+    if not patch or not hero_json or not leaderboard:
+        raise SystemExit("Не удалось скачать все фикстуры")
+    return patch["data"], hero_json, leaderboard
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", action="store_true", help="скачать настоящие ответы API")
+    parser.add_argument("--hero", default="pudge")
+    parser.add_argument("--update", default="", help="slug обновления (по умолчанию последнее)")
+    args = parser.parse_args()
+
+    if args.record:
+        patch, hero_json, leaderboard = asyncio.run(record(args.hero, args.update))
+    else:
+        rnd = random.Random(6)
+        patch, hero_json, leaderboard = make_patch(rnd), make_hero(rnd), make_leaderboard(rnd)
+
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for name, payload in (("patch_large", patch), ("hero_heavy", hero_json), ("leaderboard_full", leaderboard)):
+        path = os.path.join(FIXTURES_DIR, f"{name}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        print(f"{path}: {os.path.getsize(path) // 1024} КБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,26 @@
 import logging
 import os
+import json
 import re
 import asyncio
+import time
+import functools
+import signal
+import heapq
+import itertools
+import random
+import sqlite3
+import sys
+import hashlib
+import hmac
 import aiohttp
 import aiofiles
-from urllib.parse import urljoin
+from aiohttp import web
+from urllib.parse import urljoin, urlparse
 from datetime import datetime
-from collections import deque
+from dataclasses import dataclass
+from collections import deque, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor
 
 from telegram import (
     Update,
@@ -14,6 +28,8 @@ from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     WebAppInfo,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
 )
 from telegram.ext import (
     Application,
@@ -23,21 +39,151 @@ from telegram.ext import (
     filters,
     CallbackQueryHandler,
     ConversationHandler,
+    InlineQueryHandler,
+    BaseRateLimiter,
+    BasePersistence,
+    PersistenceInput,
 )
-from telegram.error import Conflict
+from telegram.error import Conflict, Forbidden, BadRequest, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 
 # ---------- НАСТРОЙКИ ----------
 TOKEN = os.environ.get("BOT_TOKEN")
 OWNER_ID = int(os.environ.get("OWNER_ID"))
 USER_LOG_FILE = "user_messages.txt"
 BASE_URL = "https://dota1x6.com"
-API_UPDATES_URL = "https://stats.dota1x6.com/api/v2/updates/?page=1&count=20"
-API_HEROES_URL = "https://stats.dota1x6.com/api/v2/heroes/"
-API_LEADERBOARD_URL = "https://stats.dota1x6.com/api/v2/leaderboard/"
-CDN_HEROES_INFO_URL = "https://cdn.dota1x6.com/shared/"
-API_PLAYERS_URL = "https://stats.dota1x6.com/api/v2/players/"
-API_STEAM_PROFILE_URL = "https://stats.dota1x6.com/api/v2/players/steam-profile"
-LEADERBOARD_PAGE_SIZE = 50
+# Адреса API можно подменить, например на локальные заглушки нагрузочного теста
+STATS_API_BASE = os.environ.get("STATS_API_BASE", "https://stats.dota1x6.com").rstrip("/")
+CDN_BASE = os.environ.get("CDN_BASE", "https://cdn.dota1x6.com").rstrip("/")
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+API_UPDATES_URL = f"{STATS_API_BASE}/api/v2/updates/?page=1&count=20"
+API_UPDATE_DETAILS_URL = f"{STATS_API_BASE}/api/v2/updates/"
+API_HEROES_URL = f"{STATS_API_BASE}/api/v2/heroes/"
+API_LEADERBOARD_URL = f"{STATS_API_BASE}/api/v2/leaderboard/"
+CDN_HEROES_INFO_URL = f"{CDN_BASE}/shared/"
+API_PLAYERS_URL = f"{STATS_API_BASE}/api/v2/players/"
+API_STEAM_PROFILE_URL = f"{STATS_API_BASE}/api/v2/players/steam-profile"
+LEADERBOARD_PAGE_SIZE = int(os.environ.get("LEADERBOARD_PAGE_SIZE", "50"))
+
+# HTTP-клиент для запросов к stats/cdn
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "15"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_DNS_CACHE_TTL = int(os.environ.get("HTTP_DNS_CACHE_TTL", "300"))
+
+# Повторы запросов к API по эндпоинтам (имена как в метриках): (число попыток, таймаут попытки, с).
+# Пауза перед повтором — экспоненциальная от RETRY_BASE_DELAY со случайным разбросом.
+# Попытки × таймаут не превышают прежнего общего таймаута, так что обработчик ждёт не дольше, чем раньше.
+RETRY_POLICIES = {
+    "updates": (3, 4.0),
+    "update_details": (2, 6.0),
+    "heroes": (3, 4.0),
+    "leaderboard": (3, 4.0),
+    "players": (3, 3.0),
+    "steam_profile": (2, 3.0),
+    "hero_json": (2, 6.0),
+    "other": (1, HTTP_TIMEOUT),
+}
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "0.3"))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "3"))
+# На 429 ждём столько, сколько просит Retry-After, но не дольше этого; иначе запрос не повторяем
+RETRY_AFTER_MAX = float(os.environ.get("RETRY_AFTER_MAX", "10"))
+# Предохранитель: после стольких сбоев подряд хост считается лежащим на BREAKER_RESET_TIMEOUT секунд
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", "30"))
+
+# Кэш ответов API: (префикс URL, TTL, сколько секунд после TTL можно отдавать старые данные,
+# сколько записей держать). Первое совпадение по префиксу выигрывает, URL без политики не кэшируются.
+# У каждой политики свой лимит: поток запросов игроков не вытесняет героев, ладдер и обновления.
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "512"))
+CACHE_POLICIES = [
+    (API_UPDATES_URL, int(os.environ.get("CACHE_TTL_UPDATES", "120")), 3600, 4),
+    (API_UPDATE_DETAILS_URL, int(os.environ.get("CACHE_TTL_UPDATE_DETAILS", "3600")), 86400, 64),
+    (API_HEROES_URL, int(os.environ.get("CACHE_TTL_HEROES", "600")), 86400, 4),
+    (API_LEADERBOARD_URL, int(os.environ.get("CACHE_TTL_LEADERBOARD", "120")), 3600, 4),
+    # steam-profile лежит внутри players/, поэтому идёт раньше; статистику игрока устаревшей не отдаём
+    (API_STEAM_PROFILE_URL, int(os.environ.get("CACHE_TTL_STEAM_PROFILE", "600")), 3600, CACHE_MAX_ENTRIES),
+    (API_PLAYERS_URL, int(os.environ.get("CACHE_TTL_PLAYERS", "60")), 0, CACHE_MAX_ENTRIES),
+]
+
+# Статистика нескольких игроков за раз: максимум ID в сообщении и одновременных запросов
+STATS_MAX_IDS = int(os.environ.get("STATS_MAX_IDS", "30"))
+STATS_CONCURRENCY = int(os.environ.get("STATS_CONCURRENCY", "5"))
+
+# Рассылка новых патчей подписчикам
+SUBSCRIBERS_FILE = os.environ.get("SUBSCRIBERS_FILE", "subscribers.json")
+PATCH_WATCH_INTERVAL = int(os.environ.get("PATCH_WATCH_INTERVAL", "300"))
+# При нескольких репликах за одним вебхуком патчи отслеживает и рассылает только одна (PATCH_WATCHER=1),
+# на остальных ставится PATCH_WATCHER=0 — иначе подписчики получат рассылку от каждой реплики
+PATCH_WATCHER = os.environ.get("PATCH_WATCHER", "1") == "1"
+
+# Лимиты отправки в Telegram: общий, для личного чата и для группы (сообщений в секунду / запас)
+SEND_GLOBAL_RATE = float(os.environ.get("SEND_GLOBAL_RATE", "30"))
+SEND_GLOBAL_BURST = float(os.environ.get("SEND_GLOBAL_BURST", "30"))
+SEND_CHAT_RATE = float(os.environ.get("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.environ.get("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = float(os.environ.get("SEND_GROUP_RATE", str(20 / 60)))
+SEND_GROUP_BURST = float(os.environ.get("SEND_GROUP_BURST", "5"))
+SEND_MAX_RETRIES = int(os.environ.get("SEND_MAX_RETRIES", "3"))
+
+# Локальное хранилище JSON героев с CDN
+HERO_CACHE_DIR = os.environ.get("HERO_CACHE_DIR", "hero_cache")
+HERO_REVALIDATE_INTERVAL = int(os.environ.get("HERO_REVALIDATE_INTERVAL", "3600"))
+HERO_WARMUP = os.environ.get("HERO_WARMUP", "0") == "1"
+HERO_WARMUP_CONCURRENCY = int(os.environ.get("HERO_WARMUP_CONCURRENCY", "8"))
+
+# Журнал действий пользователей: пакетная запись и ротация ("size" или "daily")
+USER_LOG_BATCH_SIZE = int(os.environ.get("USER_LOG_BATCH_SIZE", "200"))
+USER_LOG_FLUSH_INTERVAL = float(os.environ.get("USER_LOG_FLUSH_INTERVAL", "2.0"))
+USER_LOG_QUEUE_SIZE = int(os.environ.get("USER_LOG_QUEUE_SIZE", "10000"))
+USER_LOG_ROTATE = os.environ.get("USER_LOG_ROTATE", "size")
+USER_LOG_MAX_BYTES = int(os.environ.get("USER_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+USER_LOG_BACKUPS = int(os.environ.get("USER_LOG_BACKUPS", "5"))
+
+# Метрики: /metrics для владельца и, если задан порт, HTTP-эндпоинт в формате Prometheus
+METRICS_SAMPLE_SIZE = int(os.environ.get("METRICS_SAMPLE_SIZE", "2048"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Режим получения обновлений: "polling" или "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", os.environ.get("PORT", "8080")))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_QUEUE = int(os.environ.get("WEBHOOK_MAX_QUEUE", "1000"))
+WEBHOOK_SET = os.environ.get("WEBHOOK_SET", "1") == "1"
+
+# Рендер тяжёлых сообщений: inline (в цикле событий), thread или process
+RENDER_EXECUTOR = os.environ.get("RENDER_EXECUTOR", "thread")
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "2"))
+RENDER_QUEUE_SIZE = int(os.environ.get("RENDER_QUEUE_SIZE", "32"))
+RENDER_BATCH_SIZE = int(os.environ.get("RENDER_BATCH_SIZE", "20"))
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.25"))
+
+# Снимок состояния для быстрого перезапуска: кэш ответов API, готовые рендеры и данные PTB.
+# Пустое имя файла выключает снимок.
+SNAPSHOT_FILE = os.environ.get("SNAPSHOT_FILE", "bot_state.sqlite3")
+SNAPSHOT_INTERVAL = int(os.environ.get("SNAPSHOT_INTERVAL", "300"))
+
+# Поиск героев: сколько вариантов показывать и сколько секунд Telegram кэширует ответ inline-запроса
+HERO_SEARCH_LIMIT = int(os.environ.get("HERO_SEARCH_LIMIT", "8"))
+INLINE_RESULTS_LIMIT = int(os.environ.get("INLINE_RESULTS_LIMIT", "20"))
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "300"))
+
+# История патчей: сколько деталей обновлений догружать одновременно
+PATCH_HISTORY_CONCURRENCY = int(os.environ.get("PATCH_HISTORY_CONCURRENCY", "3"))
+
+# Параллельная обработка обновлений: сколько обработчиков работает одновременно
+# (обновления одного чата всё равно идут по очереди) и сколько обновлений может ждать
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "64"))
+UPDATE_PENDING_LIMIT = int(os.environ.get("UPDATE_PENDING_LIMIT", "4096"))
+# Повторное нажатие той же кнопки в чате, пока первое не обработано (для кнопок меню — и в течение окна после),
+# не запускает работу заново
+DEDUP_WINDOW = float(os.environ.get("DEDUP_WINDOW", "1.5"))
 
 # ---------- СОСТОЯНИЯ ДЛЯ CONVERSATIONHANDLER ----------
 GET_DOTA_ID = 1
@@ -54,6 +200,112 @@ if not os.path.exists(USER_LOG_FILE):
 
 RECENT_MESSAGES = deque(maxlen=3000)
 
+class UserLogWriter:
+    """Фоновая запись журнала пользователей.
+
+    Строки копятся в очереди и пишутся одним вызовом write в отдельном потоке,
+    когда набралось USER_LOG_BATCH_SIZE строк или прошло USER_LOG_FLUSH_INTERVAL секунд.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path, batch_size, flush_interval, queue_size, rotate, max_bytes, backups):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate = rotate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._task = None
+        self._file_date = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self.queue.put(self._STOP)
+        await self._task
+        self._task = None
+
+    def write(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            line = await self.queue.get()
+            if line is self._STOP:
+                break
+            batch = [line]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    line = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if line is self._STOP:
+                    stopping = True
+                    break
+                batch.append(line)
+            try:
+                await asyncio.to_thread(self._write_batch, "".join(batch))
+            except Exception:
+                logger.exception("Не удалось записать лог пользователей")
+
+    def _write_batch(self, text):
+        self._rotate_if_needed(len(text.encode("utf-8")))
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(text)
+
+    def _rotate_if_needed(self, incoming_bytes):
+        if not os.path.exists(self.path):
+            return
+        if self.rotate == "daily":
+            today = datetime.now().date()
+            if self._file_date is None:
+                self._file_date = datetime.fromtimestamp(os.path.getmtime(self.path)).date()
+            if self._file_date == today:
+                return
+            os.replace(self.path, f"{self.path}.{self._file_date.isoformat()}")
+            self._file_date = today
+            old_files = sorted(
+                name for name in os.listdir(os.path.dirname(os.path.abspath(self.path)))
+                if name.startswith(os.path.basename(self.path) + ".")
+            )
+            for name in old_files[:-self.backups or None]:
+                os.remove(os.path.join(os.path.dirname(os.path.abspath(self.path)), name))
+        else:
+            if os.path.getsize(self.path) + incoming_bytes <= self.max_bytes:
+                return
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            if self.backups > 0:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+
+USER_LOG_WRITER = UserLogWriter(
+    USER_LOG_FILE,
+    USER_LOG_BATCH_SIZE,
+    USER_LOG_FLUSH_INTERVAL,
+    USER_LOG_QUEUE_SIZE,
+    USER_LOG_ROTATE,
+    USER_LOG_MAX_BYTES,
+    USER_LOG_BACKUPS,
+)
+
 async def log_user_message(user, text):
     try:
         log_line = (
@@ -61,8 +313,7 @@ async def log_user_message(user, text):
             f"Имя:{getattr(user, 'first_name', None)} | "
             f"Username:@{getattr(user, 'username', None)} | {text}\n"
         )
-        async with aiofiles.open(USER_LOG_FILE, "a", encoding="utf-8") as f:
-            await f.write(log_line)
+        USER_LOG_WRITER.write(log_line)
         RECENT_MESSAGES.append(log_line)
     except Exception:
         logger.exception("Не удалось записать лог пользователя")
@@ -139,21 +390,58 @@ def escape_markdown_v2(text):
     escape_chars = r"[_*[\]()~`>#+\-=|{}.!]"
     return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', text)
 
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+def annotate_sequential(text, keys, emoji_map):
+    """Эталонная разметка: один re.sub на каждый ключ, от длинных к коротким."""
+    for key in keys:
+        pattern = r'\b' + re.escape(key) + r'\b'
+        text = re.sub(pattern, f"{emoji_map[key]} {key}", text, flags=re.IGNORECASE)
+    return text
+
+class EmojiAnnotator:
+    """Расставляет эмодзи способностей за один проход одним скомпилированным регэкспом.
+
+    Результат совпадает с annotate_sequential: там более короткие ключи применялись
+    и к уже вставленному тексту ("Spear of Mars" -> "🔱 🔱 spear of Mars"),
+    поэтому каждая замена заранее прогоняется через оставшиеся ключи.
+    """
+
+    def __init__(self, emoji_map):
+        self.keys = sorted(emoji_map.keys(), key=len, reverse=True)
+        self.emoji_map = emoji_map
+        self.pattern = re.compile(
+            r'\b(?:' + '|'.join(re.escape(key) for key in self.keys) + r')\b', re.IGNORECASE
+        )
+        self.replacements = {}
+        for i, key in enumerate(self.keys):
+            replacement = annotate_sequential(f"{emoji_map[key]} {key}", self.keys[i + 1:], emoji_map)
+            self.replacements.setdefault(key.lower(), replacement)
+
+    def _replace(self, match):
+        found = match.group(0)
+        replacement = self.replacements.get(found.lower())
+        if replacement is None:
+            # IGNORECASE в re шире str.lower() (например, "K" Кельвина)
+            for i, key in enumerate(self.keys):
+                if re.fullmatch(re.escape(key), found, re.IGNORECASE):
+                    replacement = annotate_sequential(
+                        f"{self.emoji_map[key]} {key}", self.keys[i + 1:], self.emoji_map
+                    )
+                    break
+        return replacement
+
+    def annotate(self, text):
+        return self.pattern.sub(self._replace, text)
+
+SKILL_EMOJI_ANNOTATOR = EmojiAnnotator(SKILL_EMOJI_MAP)
+
 def format_text_with_emojis(text):
     if not isinstance(text, str):
         return ""
 
-    formatted_text = text
-    
-    formatted_text = re.sub(r'<[^>]+>', '', formatted_text)
-    
-    sorted_keys = sorted(SKILL_EMOJI_MAP.keys(), key=len, reverse=True)
-    for key in sorted_keys:
-        emoji = SKILL_EMOJI_MAP[key]
-        pattern = r'\b' + re.escape(key) + r'\b'
-        formatted_text = re.sub(pattern, f"{emoji} {key}", formatted_text, flags=re.IGNORECASE)
-    
-    return formatted_text
+    formatted_text = HTML_TAG_RE.sub('', text)
+    return SKILL_EMOJI_ANNOTATOR.annotate(formatted_text)
 
 def get_change_emoji(change_type: str) -> str:
     """Возвращает эмодзи в зависимости от типа изменения."""
@@ -165,41 +453,1226 @@ def get_change_emoji(change_type: str) -> str:
         return EMOJI_MAP.get("change", "🟡")
     return ""
 
-async def send_long_message(context: ContextTypes.DEFAULT_TYPE, chat_id, text, parse_mode='MarkdownV2'):
-    max_length = 4096
-    
-    parts = text.split('\n')
-    current_message = ""
-    
-    for part in parts:
-        if len(current_message) + len(part) + 1 < max_length:
-            current_message += part + "\n"
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Лексемы MarkdownV2: экранирование, перевод строки, пробел, code/pre и ссылки целиком,
+# метки сущностей, слово без служебных символов, любой другой символ
+MDV2_TOKEN_RE = re.compile(
+    r"(?P<escape>\\.)"
+    r"|(?P<newline>\n)"
+    r"|(?P<space> )"
+    r"|(?P<code>```(?:\\.|[^\\])*?```|`(?:\\.|[^`\\])*`)"
+    r"|(?P<link>!?\[(?:\\.|[^\]\\])*\]\((?:\\.|[^)\\])*\))"
+    r"|(?P<mark>\|\||__|[*_~])"
+    r"|(?P<text>[^\\\n `\[!|_*~]+|.)",
+    re.S,
+)
+
+MDV2_ESCAPE_UNIT_RE = re.compile(r"\\.|.", re.S)
+MDV2_LINK_TEXT_RE = re.compile(r"!?\[((?:\\.|[^\]\\])*)\]\(")
+
+def utf16_len(text):
+    return len(text.encode("utf-16-le")) // 2
+
+class MarkdownV2Packer:
+    """Собирает MarkdownV2-текст в сообщения, заполняя каждое почти до лимита.
+
+    Длина считается так же, как у Telegram: видимые символы после разбора разметки
+    (в UTF-16). Разрез идёт по строкам, для слишком длинной строки — по словам, затем
+    внутри слова; экранирование, code/pre и ссылки не разрываются. Открытые на месте
+    разреза сущности закрываются в конце сообщения и открываются заново в следующем.
+    Текст можно подавать частями через feed(), границы частей должны совпадать с границами лексем.
+    """
+
+    def __init__(self, limit=TELEGRAM_MESSAGE_LIMIT):
+        self.limit = limit
+        self._stack = []
+        self._start_stack = []
+        self._tokens = []
+        self._visible = 0
+        self._ready = []
+
+    @staticmethod
+    def tokenize(text):
+        tokens = []
+        for match in MDV2_TOKEN_RE.finditer(text):
+            kind = match.lastgroup
+            raw = match.group()
+            if kind == "escape":
+                visible = utf16_len(raw[1])
+            elif kind == "mark":
+                visible = 0
+            elif kind == "link":
+                link_text = MDV2_LINK_TEXT_RE.match(raw).group(1)
+                visible = sum(token[1] for token in MarkdownV2Packer.tokenize(link_text))
+            else:
+                visible = utf16_len(raw)
+            tokens.append((raw, visible, kind))
+        return tokens
+
+    def feed(self, text):
+        """Добавляет текст и возвращает сообщения, которые уже не будут дополняться."""
+        return self.feed_tokens(self.tokenize(text))
+
+    def feed_tokens(self, tokens):
+        """То же, что feed(), для текста, заранее разобранного через tokenize()."""
+        line = []
+        for token in tokens:
+            line.append(token)
+            if token[2] == "newline":
+                self._add_line(line)
+                line = []
+        if line:
+            self._add_line(line)
+        ready, self._ready = self._ready, []
+        return ready
+
+    def finish(self):
+        self._flush()
+        ready, self._ready = self._ready, []
+        return ready
+
+    def _add_line(self, line):
+        self._add_unit(line, self._split_words)
+
+    def _split_words(self, line):
+        words = []
+        word = []
+        for token in line:
+            word.append(token)
+            if token[2] in ("space", "newline"):
+                words.append(word)
+                word = []
+        if word:
+            words.append(word)
+        for word in words:
+            self._add_unit(word, self._split_tokens)
+
+    def _split_tokens(self, word):
+        for token in word:
+            self._add_unit([token], self._split_token)
+
+    def _split_token(self, tokens):
+        raw, visible, kind = tokens[0]
+        if kind == "code":
+            fence = "```" if raw.startswith("```") else "`"
+            body = raw[len(fence):-len(fence)]
+            pieces = self._cut(body, self.limit - 2)
+            for piece in pieces:
+                self._add_unit([(fence + piece + fence, utf16_len(piece), "code")], None)
+        elif kind == "text":
+            for piece in self._cut(raw, self.limit):
+                self._add_unit([(piece, utf16_len(piece), "text")], None)
         else:
-            if current_message:
-                await context.bot.send_message(chat_id=chat_id, text=current_message, parse_mode=parse_mode)
-                await asyncio.sleep(0.5)
-            current_message = part + "\n"
-            
-    if current_message:
-        await context.bot.send_message(chat_id=chat_id, text=current_message, parse_mode=parse_mode)
+            # Ссылка длиннее целого сообщения: оставляем только её текст
+            link_text = MDV2_LINK_TEXT_RE.match(raw).group(1)
+            self._split_words(self.tokenize(link_text))
+
+    @staticmethod
+    def _cut(text, size):
+        pieces = []
+        current = ""
+        current_len = 0
+        # режем только между лексемами: обратный слэш не отрывается от экранируемого символа
+        for unit in MDV2_ESCAPE_UNIT_RE.findall(text):
+            unit_len = utf16_len(unit)
+            if current and current_len + unit_len > size:
+                pieces.append(current)
+                current, current_len = "", 0
+            current += unit
+            current_len += unit_len
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def _add_unit(self, tokens, split):
+        visible = sum(token[1] for token in tokens)
+        if self._visible + visible > self.limit:
+            if visible <= self.limit or split is None:
+                self._flush()
+            if visible > self.limit and split is not None:
+                split(tokens)
+                return
+        for raw, token_visible, kind in tokens:
+            opened = False
+            if kind == "mark":
+                if raw in self._stack:
+                    self._stack.remove(raw)
+                else:
+                    self._stack.append(raw)
+                    opened = True
+            self._tokens.append((raw, token_visible, kind, opened))
+        self._visible += visible
+
+    @staticmethod
+    def _join_marks(text, marks):
+        for mark in marks:
+            # "___" Telegram читает неоднозначно — разделяем символом \r, который он пропускает
+            if mark.startswith("_") and text.endswith("_") and not text.endswith("\\_"):
+                text += "\r"
+            text += mark
+        return text
+
+    def _flush(self):
+        carry = []
+        while self._tokens and self._tokens[-1][2] == "mark" and self._tokens[-1][3]:
+            carry.insert(0, self._tokens.pop())
+        closing_stack = self._stack[:len(self._stack) - len(carry)]
+
+        has_content = any(kind not in ("mark", "space", "newline") for _, _, kind, _ in self._tokens)
+        if has_content:
+            text = self._join_marks("", self._start_stack)
+            for raw, _, kind, _ in self._tokens:
+                text = self._join_marks(text, [raw]) if kind == "mark" else text + raw
+            text = self._join_marks(text, reversed(closing_stack))
+            self._ready.append(text)
+
+        self._start_stack = closing_stack
+        self._tokens = carry
+        self._visible = 0
+
+def pack_markdown_v2(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    packer = MarkdownV2Packer(limit)
+    return packer.feed(text) + packer.finish()
+
+def split_plain_text(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Делит обычный текст на сообщения по строкам; строка длиннее limit режется на куски."""
+    chunks, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    chunks.append(current)
+    # Telegram не принимает пустые сообщения
+    return [chunk for chunk in chunks if chunk.strip()]
+
+# ---------- МЕТРИКИ ----------
+class Metrics:
+    """Счётчики, ошибки, выполняющиеся запросы и задержки (p50/p95/p99 по последним замерам).
+
+    Серии задаются парой (kind, name): kind — "handler", "upstream", "telegram" и т.п.
+    """
+
+    def __init__(self, sample_size):
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.in_flight = defaultdict(int)
+        self.total_seconds = defaultdict(float)
+        self.samples = defaultdict(lambda: deque(maxlen=sample_size))
+
+    def observe(self, kind, name, seconds, error=False):
+        key = (kind, name)
+        self.counts[key] += 1
+        self.total_seconds[key] += seconds
+        self.samples[key].append(seconds)
+        if error:
+            self.errors[key] += 1
+
+    def track(self, kind, name):
+        return MetricsTimer(self, kind, name)
+
+    def percentiles(self, key):
+        values = sorted(self.samples[key])
+        if not values:
+            return 0.0, 0.0, 0.0
+        pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+        return pick(0.50), pick(0.95), pick(0.99)
+
+    def format_text(self):
+        lines = []
+        current_kind = None
+        for key in sorted(self.counts):
+            kind, name = key
+            if kind != current_kind:
+                lines.append(f"[{kind}]")
+                current_kind = kind
+            p50, p95, p99 = self.percentiles(key)
+            lines.append(
+                f"{name}: n={self.counts[key]} err={self.errors[key]} now={self.in_flight[key]} "
+                f"p50={p50 * 1000:.0f}ms p95={p95 * 1000:.0f}ms p99={p99 * 1000:.0f}ms"
+            )
+        return "\n".join(lines) or "Пока нет данных."
+
+    def format_prometheus(self, extra_counters=()):
+        lines = [
+            "# TYPE bot_requests_total counter",
+            "# TYPE bot_errors_total counter",
+            "# TYPE bot_in_flight gauge",
+            "# TYPE bot_latency_seconds summary",
+        ]
+        for key in sorted(self.counts):
+            labels = f'kind="{key[0]}",name="{key[1]}"'
+            lines.append(f"bot_requests_total{{{labels}}} {self.counts[key]}")
+            lines.append(f"bot_errors_total{{{labels}}} {self.errors[key]}")
+            lines.append(f"bot_in_flight{{{labels}}} {self.in_flight[key]}")
+            for quantile, value in zip(("0.5", "0.95", "0.99"), self.percentiles(key)):
+                lines.append(f'bot_latency_seconds{{{labels},quantile="{quantile}"}} {value:.6f}')
+            lines.append(f"bot_latency_seconds_sum{{{labels}}} {self.total_seconds[key]:.6f}")
+            lines.append(f"bot_latency_seconds_count{{{labels}}} {self.counts[key]}")
+        typed = set()
+        for metric, labels, value in extra_counters:
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+class MetricsTimer:
+    """Контекстный менеджер замера: учитывает выполняющиеся запросы и исключения.
+
+    Неудачу без исключения можно отметить через timer.failed = True.
+    """
+
+    __slots__ = ("metrics", "key", "started", "failed")
+
+    def __init__(self, metrics, kind, name):
+        self.metrics = metrics
+        self.key = (kind, name)
+        self.failed = False
+
+    def __enter__(self):
+        self.metrics.in_flight[self.key] += 1
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.in_flight[self.key] -= 1
+        self.metrics.observe(*self.key, time.perf_counter() - self.started, self.failed or exc_type is not None)
+        return False
+
+METRICS = Metrics(METRICS_SAMPLE_SIZE)
+
+# ---------- ПУЛ РЕНДЕРА ----------
+class RenderPool:
+    """Выполняет чистые функции рендера вне цикла событий.
+
+    mode: "inline" — прямо в цикле, "thread" — пул потоков, "process" — пул процессов
+    (функция и аргументы должны сериализоваться pickle). В пуле одновременно не больше
+    queue_size задач, остальные ждут очереди в цикле событий.
+    """
+
+    def __init__(self, mode, workers, queue_size):
+        self.mode = mode
+        self.workers = workers
+        self.executor = None
+        self._slots = asyncio.Semaphore(queue_size)
+
+    def start(self):
+        if self.mode == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render")
+        elif self.mode == "process":
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        logger.info(f"Рендер: {self.mode}, воркеров {self.workers}")
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, func, *args):
+        with METRICS.track("render", func.__name__):
+            if self.executor is None:
+                result = func(*args)
+                # даём циклу обработать накопившиеся события между кусками работы
+                await asyncio.sleep(0)
+                return result
+            async with self._slots:
+                executor = self.executor
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+                except BrokenExecutor:
+                    # Упал процесс пула: пересоздаём пул, а эту задачу выполняем в цикле
+                    logger.error("Пул рендера сломан, пересоздаю")
+                    if self.executor is executor:
+                        self.stop()
+                        self.start()
+                    return func(*args)
+
+RENDER_POOL = RenderPool(RENDER_EXECUTOR, RENDER_WORKERS, RENDER_QUEUE_SIZE)
+
+class LoopLagMonitor:
+    """Замеряет задержку цикла событий: насколько позже заданного просыпается sleep.
+
+    Замеры попадают в METRICS как серия ("loop", "lag").
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            METRICS.observe("loop", "lag", max(0.0, time.perf_counter() - started - self.interval))
+
+LOOP_LAG_MONITOR = LoopLagMonitor(LOOP_LAG_INTERVAL)
+
+def instrumented(callback, kind="handler"):
+    """Оборачивает колбэк обработчика или задачи замером времени и ошибок."""
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        with METRICS.track(kind, callback.__name__):
+            return await callback(*args, **kwargs)
+
+    return wrapper
+
+def instrument_handlers(application):
+    """Оборачивает все зарегистрированные обработчики, включая вложенные в ConversationHandler."""
+
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for nested in handler.entry_points + handler.fallbacks:
+                wrap(nested)
+            for state_handlers in handler.states.values():
+                for nested in state_handlers:
+                    wrap(nested)
+        else:
+            handler.callback = instrumented(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, замеряющий каждый вызов Bot API по имени метода."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        with METRICS.track("telegram", url.rsplit("/", 1)[-1]) as timer:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            timer.failed = code >= 400
+            return code, payload
+
+def endpoint_name(url):
+    # API_STEAM_PROFILE_URL проверяется раньше API_PLAYERS_URL: последний его префикс
+    for prefix, name in (
+        (API_UPDATES_URL, "updates"),
+        (API_UPDATE_DETAILS_URL, "update_details"),
+        (API_HEROES_URL, "heroes"),
+        (API_LEADERBOARD_URL, "leaderboard"),
+        (API_STEAM_PROFILE_URL, "steam_profile"),
+        (API_PLAYERS_URL, "players"),
+        (CDN_HEROES_INFO_URL, "hero_json"),
+    ):
+        if url.startswith(prefix):
+            return name
+    return "other"
+
+def cache_counters():
+    counters = [
+        ("bot_cache_events_total", f'cache="response",event="{event}"', value)
+        for event, value in RESPONSE_CACHE.stats.items()
+    ]
+    counters += [
+        ("bot_cache_events_total", f'cache="hero_store",event="{event}"', value)
+        for event, value in HERO_STORE.stats.items()
+    ]
+    for host, breaker in BREAKERS.items():
+        counters.append(("bot_breaker_opens_total", f'host="{host}"', breaker.opens))
+        counters.append(("bot_breaker_rejected_total", f'host="{host}"', breaker.rejected))
+    counters.append(("bot_user_log_dropped_total", 'file="user_log"', USER_LOG_WRITER.dropped))
+    return counters
+
+async def metrics_http_handler(request):
+    return web.Response(text=METRICS.format_prometheus(cache_counters()), content_type="text/plain")
+
+async def start_metrics_server():
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_http_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info(f"Метрики доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+# ---------- ОТПРАВКА СООБЩЕНИЙ ----------
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self):
+        """Сколько секунд ждать до следующего жетона (0, если он уже есть)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self):
+        return self.delay() == 0 and self.tokens >= self.capacity
+
+class SendScheduler(BaseRateLimiter):
+    """Планировщик исходящих сообщений Bot API.
+
+    Каждый чат ограничен своим ведром жетонов, весь бот — общим. Общие жетоны
+    раздаются по приоритету: интерактивные ответы раньше рассылок
+    (rate_limit_args={"priority": PRIORITY_BULK}). На RetryAfter чат ставится на паузу
+    и запрос повторяется.
+    """
+
+    LIMITED_ENDPOINTS = {
+        "sendMessage", "editMessageText", "editMessageReplyMarkup", "sendPhoto",
+        "sendDocument", "sendMediaGroup", "copyMessage", "forwardMessage",
+    }
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self):
+        self._global = TokenBucket(SEND_GLOBAL_RATE, SEND_GLOBAL_BURST)
+        self._chats = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._dispatcher = None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_idle()}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(SEND_GROUP_RATE, SEND_GROUP_BURST)
+            else:
+                bucket = TokenBucket(SEND_CHAT_RATE, SEND_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id, priority):
+        if chat_id is not None:
+            bucket = self._chat_bucket(chat_id)
+            while (wait := bucket.delay()) > 0:
+                await asyncio.sleep(wait)
+            bucket.take()
+
+        if not self._waiters and self._global.delay() == 0:
+            self._global.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            wait = self._global.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._global.take()
+            future.set_result(None)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint not in self.LIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_INTERACTIVE)
+        chat_id = data.get("chat_id")
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            started = time.perf_counter()
+            await self._acquire(chat_id, priority)
+            METRICS.observe("send_wait", "bulk" if priority else "interactive", time.perf_counter() - started)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == SEND_MAX_RETRIES:
+                    raise
+                logger.warning(f"Flood control для чата {chat_id}: ждём {e.retry_after} с")
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+                else:
+                    self._global.pause(e.retry_after)
+
+# ---------- МОДЕЛИ ДАННЫХ ----------
+# Ответы API разбираются в компактные записи один раз, когда попадают в кэш в памяти:
+# имя героя (userFriendlyName или userFrendlyName) выбирается здесь, строки изменений
+# хранятся без пустых строк. Сырые JSON остаются на диске и в снимке состояния.
+
+def _rows(text):
+    """Непустые строки изменения через \\n; "" если текста нет."""
+    if not isinstance(text, str):
+        return ""
+    return "\n".join(line.strip() for line in text.split("\n") if line.strip())
+
+def _token(value):
+    """Повторяющиеся короткие значения (тип изменения, атрибут) храним одной копией."""
+    return sys.intern(value) if isinstance(value, str) else ""
+
+def friendly_name(data, default=""):
+    return data.get("userFriendlyName") or data.get("userFrendlyName") or default
+
+@dataclass(slots=True)
+class ItemChange:
+    name: str
+    change_type: str
+    rows: str
+
+@dataclass(slots=True)
+class UpgradeChange:
+    kind: str
+    change_type: str
+    rows: str
+
+@dataclass(slots=True)
+class TalentChange:
+    name: str
+    # orange / purple / blue или "", если меняется только способность
+    tier: str
+    change_type: str
+    rows: str
+
+@dataclass(slots=True)
+class HeroChange:
+    api: str
+    name: str
+    change_type: str
+    rows: str
+    upgrades: tuple
+    talents: tuple
+
+@dataclass(slots=True)
+class Patch:
+    title: str
+    change_type: str
+    rows: str
+    items: tuple
+    heroes: tuple
+
+def parse_talent_change(talent):
+    tier = ""
+    for color in ("orange", "purple", "blue"):
+        if talent.get(f"{color}RuRows"):
+            tier = color
+            break
+    rows = [_rows(talent.get(key)) for key in ("abilityRuRows", "orangeRuRows", "purpleRuRows", "blueRuRows")]
+    return TalentChange(
+        name=talent.get("name") or "",
+        tier=_token(tier),
+        change_type=_token(talent.get("changeType")),
+        rows="\n".join(row for row in rows if row),
+    )
+
+def parse_hero_change(hero):
+    upgrades = []
+    for upgrade in hero.get("upgrades") or ():
+        rows = _rows(upgrade.get("ruRows"))
+        if rows:
+            upgrades.append(UpgradeChange(
+                kind=_token(str(upgrade.get("type") or "").lower()),
+                change_type=_token(upgrade.get("changeType")),
+                rows=rows,
+            ))
+    return HeroChange(
+        api=hero.get("name") or "",
+        name=friendly_name(hero),
+        change_type=_token(hero.get("changeType")),
+        rows=_rows(hero.get("ruRows")),
+        upgrades=tuple(upgrades),
+        talents=tuple(parse_talent_change(talent) for talent in hero.get("talents") or ()),
+    )
+
+def parse_patch(data):
+    """Patch из data ответа /api/v2/updates/<slug>. Предметы без описания изменений отбрасываются."""
+    items = []
+    for item in data.get("items") or ():
+        rows = _rows(item.get("ruRows"))
+        if rows:
+            items.append(ItemChange(name=item.get("name") or "", change_type=_token(item.get("changeType")), rows=rows))
+    return Patch(
+        title=data.get("ruName") or "",
+        change_type=_token(data.get("changeType")),
+        rows=_rows(data.get("ruRows")),
+        items=tuple(items),
+        heroes=tuple(parse_hero_change(hero) for hero in data.get("heroes") or ()),
+    )
+
+@dataclass(slots=True)
+class AbilityNote:
+    name: str
+    description: str
+
+@dataclass(slots=True)
+class HeroUpgrade:
+    kind: str
+    description: str
+    # ((подпись, значение), ...)
+    extra_values: tuple
+
+@dataclass(slots=True)
+class HeroDetails:
+    name: str
+    changes: tuple
+    upgrades: tuple
+    # ((цвет, (описание, ...)), ...) в порядке вывода: purple, blue, orange
+    talents: tuple
+
+def parse_hero_details(hero_json):
+    """HeroDetails из JSON героя с CDN (ru_<имя>.json)."""
+    talents = []
+    for color in ("purple", "blue", "orange"):
+        skills = hero_json.get(f"{color}Talents")
+        if skills and isinstance(skills, dict):
+            descriptions = tuple(
+                talent.get("description")
+                for skill_talents in skills.values() for talent in skill_talents
+                if isinstance(talent.get("description"), str) and talent.get("description")
+            )
+            talents.append((_token(color), descriptions))
+    return HeroDetails(
+        name=friendly_name(hero_json, "Герой"),
+        changes=tuple(
+            AbilityNote(name=change.get("name") or "", description=change.get("description") or "")
+            for change in hero_json.get("changes") or ()
+        ),
+        upgrades=tuple(
+            HeroUpgrade(
+                kind=_token(upgrade.get("upgradeType") or "unknown"),
+                description=upgrade.get("description") or "",
+                extra_values=tuple((pair[0], pair[1]) for pair in upgrade.get("extraValues") or () if len(pair) >= 2),
+            )
+            for upgrade in hero_json.get("upgrades") or ()
+        ),
+        talents=tuple(talents),
+    )
+
+@dataclass(slots=True)
+class HeroSummary:
+    api: str
+    name: str
+    attribute: str
+
+def parse_heroes(heroes_data):
+    """Герои из ответа /api/v2/heroes/; без имени или API-имени пропускаются."""
+    heroes = heroes_data.get("data", {}).get("heroes", [])
+    return [
+        HeroSummary(api=hero["name"], name=friendly_name(hero), attribute=_token(hero.get("attribute")))
+        for hero in heroes
+        if hero.get("name") and friendly_name(hero)
+    ]
+
+@dataclass(slots=True)
+class LadderPlayer:
+    place: object
+    nickname: object
+    rating: object
+    match_count: object
+    favorite_hero: str
+    youtube: str
+    twitch: str
+    youtube_live: bool
+    twitch_live: bool
+
+def parse_ladder_player(player):
+    social = player.get("social") or {}
+    return LadderPlayer(
+        place=player.get("place"),
+        nickname=player.get("nickname"),
+        rating=player.get("rating"),
+        match_count=player.get("matchCount"),
+        favorite_hero=player.get("favoriteHero") or "",
+        youtube=social.get("youtube") or "",
+        twitch=social.get("twitch") or "",
+        youtube_live=bool(social.get("isYoutubeLive")),
+        twitch_live=bool(social.get("isTwitchLive")),
+    )
 
 # ---------- API ----------
-async def fetch_json(url):
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=15) as response:
+HTTP_SESSION = None
+HTTP_SESSION_SHUT_DOWN = False
+
+def get_http_session():
+    """Возвращает общий aiohttp-клиент с пулом keep-alive соединений."""
+    global HTTP_SESSION
+    # После остановки новый клиент уже никто не закроет
+    if HTTP_SESSION_SHUT_DOWN:
+        raise RuntimeError("HTTP-клиент закрыт: бот останавливается")
+    if HTTP_SESSION is None or HTTP_SESSION.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        HTTP_SESSION = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return HTTP_SESSION
+
+async def close_http_session():
+    global HTTP_SESSION, HTTP_SESSION_SHUT_DOWN
+    HTTP_SESSION_SHUT_DOWN = True
+    if HTTP_SESSION is not None and not HTTP_SESSION.closed:
+        await HTTP_SESSION.close()
+    HTTP_SESSION = None
+
+class CircuitBreaker:
+    """Предохранитель для одного хоста.
+
+    После threshold сбоев подряд запросы к хосту сразу отклоняются; раз в reset_timeout
+    пропускается одна пробная попытка, успешный ответ снова открывает доступ.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.opens = 0
+        self.rejected = 0
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_timeout:
+            self.rejected += 1
+            return False
+        # пробная попытка; следующая — не раньше чем через reset_timeout, даже если эта зависнет
+        self.opened_at = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.opens += 1
+            self.opened_at = time.monotonic()
+
+BREAKERS = {}
+
+def breaker_for(url):
+    host = urlparse(url).netloc
+    breaker = BREAKERS.get(host)
+    if breaker is None:
+        breaker = BREAKERS[host] = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+    return breaker
+
+# Ответы, после которых есть смысл повторить запрос
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+async def _get_once(url, headers, timeout):
+    """Одна попытка GET. Возвращает (status, payload, заголовки ответа, стоит ли повторять)."""
+    with METRICS.track("upstream", endpoint_name(url)) as timer:
+        try:
+            session = get_http_session()
+            attempt_timeout = aiohttp.ClientTimeout(total=timeout, connect=min(timeout, HTTP_CONNECT_TIMEOUT))
+            async with session.get(url, headers=headers, timeout=attempt_timeout) as response:
+                if response.status == 304:
+                    return 304, None, response.headers, False
+                if response.status in RETRYABLE_STATUSES:
+                    logger.error(f"HTTP {response.status} fetching {url}")
+                    timer.failed = True
+                    return response.status, None, response.headers, True
                 response.raise_for_status()
-                return await response.json()
-    except aiohttp.ClientError as e:
-        logger.error(f"HTTP error fetching {url}: {e}")
-        return None
-    except asyncio.TimeoutError:
-        logger.error(f"Timeout fetching {url}")
+                return response.status, await response.json(content_type=None), response.headers, False
+        except aiohttp.ClientResponseError as e:
+            logger.error(f"HTTP error fetching {url}: {e}")
+            timer.failed = True
+            return e.status, None, {}, False
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            # Например, HTML-страница ошибки с кодом 200: ответа нет, хост считается сбойным
+            logger.error(f"Invalid JSON fetching {url}: {e}")
+            retryable = False
+        except aiohttp.ClientError as e:
+            logger.error(f"HTTP error fetching {url}: {e}")
+            retryable = True
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout fetching {url}")
+            retryable = True
+        except Exception as e:
+            logger.error(f"An error occurred while fetching {url}: {e}")
+            retryable = False
+        timer.failed = True
+        return None, None, {}, retryable
+
+def retry_after_seconds(headers):
+    """Retry-After в секундах; None, если заголовка нет или там дата."""
+    try:
+        return max(0.0, float(headers.get("Retry-After", "")))
+    except ValueError:
         return None
-    except Exception as e:
-        logger.error(f"An error occurred while fetching {url}: {e}")
+
+async def fetch_upstream(url, headers=None):
+    """GET с повторами по политике эндпоинта и предохранителем хоста.
+
+    Возвращает (status, payload, заголовки ответа); status равен None, если ответа нет.
+    """
+    attempts, timeout = RETRY_POLICIES.get(endpoint_name(url), RETRY_POLICIES["other"])
+    breaker = breaker_for(url)
+    delay = None
+    for attempt in range(attempts):
+        if attempt:
+            if delay is None:
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            await asyncio.sleep(delay)
+            delay = None
+        if not breaker.allow():
+            logger.warning(f"Хост {urlparse(url).netloc} недоступен, запрос {url} не отправлен")
+            break
+        status, payload, response_headers, retryable = await _get_once(url, headers, timeout)
+        if not retryable:
+            if status is None:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return status, payload, response_headers
+        if status == 429:
+            # Ограничение частоты — не сбой хоста: предохранитель не трогаем, ждём сколько просят
+            delay = retry_after_seconds(response_headers)
+            if delay is not None and delay > RETRY_AFTER_MAX:
+                logger.warning(f"{url}: Retry-After {delay:.0f} с, запрос не повторяем")
+                break
+            continue
+        breaker.record_failure()
+    return None, None, {}
+
+async def fetch_json_uncached(url):
+    _, payload, _ = await fetch_upstream(url)
+    return payload
+
+async def fetch_json_conditional(url, etag=None, last_modified=None):
+    """Условный GET с If-None-Match / If-Modified-Since.
+
+    Возвращает (status, payload, etag, last_modified); status равен None при ошибке сети.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    status, payload, response_headers = await fetch_upstream(url, headers)
+    if status == 304:
+        return 304, None, etag, last_modified
+    if payload is None:
+        return None, None, None, None
+    return status, payload, response_headers.get("ETag"), response_headers.get("Last-Modified")
+
+# data — ответ API; stale — API недоступен и отдан последний сохранённый ответ
+FetchResult = namedtuple("FetchResult", "data stale")
+
+class ResponseCache:
+    """TTL-кэш ответов API с отдачей устаревших данных на время фонового обновления.
+
+    Одновременные промахи по одному URL ждут один общий запрос. Если API не ответил,
+    отдаётся последний сохранённый ответ любой давности. Записи каждой политики хранятся
+    отдельно и вытесняются по давности последнего обращения.
+    """
+
+    def __init__(self, policies):
+        self.policies = policies
+        self._entries = {policy[0]: {} for policy in policies}
+        self._inflight = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "coalesced": 0, "fallbacks": 0}
+
+    def policy_for(self, url):
+        """(префикс, TTL, max_stale, лимит записей) первой подходящей политики или None."""
+        for policy in self.policies:
+            if url.startswith(policy[0]):
+                return policy
         return None
 
+    async def get(self, url, loader):
+        return (await self.get_result(url, loader)).data
+
+    async def get_result(self, url, loader):
+        """Как get(), но возвращает FetchResult с признаком аварийно устаревших данных."""
+        policy = self.policy_for(url)
+        if policy is None:
+            return FetchResult(await loader(url), False)
+        prefix, ttl, max_stale, _ = policy
+
+        entries = self._entries[prefix]
+        entry = entries.pop(url, None)
+        if entry is not None:
+            # в конец словаря: вытесняются записи, к которым дольше всего не обращались
+            entries[url] = entry
+            payload, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < ttl:
+                self.stats["hits"] += 1
+                return FetchResult(payload, False)
+            if age < ttl + max_stale:
+                self.stats["stale_hits"] += 1
+                if url not in self._inflight:
+                    self.stats["refreshes"] += 1
+                    self._start_load(url, loader)
+                return FetchResult(payload, False)
+
+        self.stats["misses"] += 1
+        task = self._inflight.get(url)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            task = self._start_load(url, loader)
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        payload = await asyncio.shield(task)
+        if payload is None and entry is not None:
+            self.stats["fallbacks"] += 1
+            return FetchResult(entry[0], True)
+        return FetchResult(payload, False)
+
+    def _start_load(self, url, loader):
+        task = asyncio.ensure_future(self._load(url, loader))
+        self._inflight[url] = task
+        task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return task
+
+    async def _load(self, url, loader):
+        payload = await loader(url)
+        if payload is not None:
+            self.put(url, payload)
+        return payload
+
+    def pending_tasks(self):
+        return list(self._inflight.values())
+
+    def put(self, url, payload):
+        policy = self.policy_for(url)
+        if policy is None:
+            return
+        entries = self._entries[policy[0]]
+        entries.pop(url, None)
+        entries[url] = (payload, time.monotonic())
+        self._trim(policy)
+
+    def _trim(self, policy):
+        entries = self._entries[policy[0]]
+        while len(entries) > policy[3]:
+            entries.pop(next(iter(entries)))
+
+    def export(self):
+        """Записи кэша для снимка: время получения переводится в часы реального времени."""
+        now_wall, now = time.time(), time.monotonic()
+        return {
+            url: {"payload": payload, "fetched_at": now_wall - (now - fetched_at)}
+            for entries in self._entries.values()
+            for url, (payload, fetched_at) in entries.items()
+        }
+
+    def restore(self, entries):
+        """Загружает записи из снимка, сохраняя их возраст; более свежие данные в памяти не трогает.
+
+        Возвращает число записей в кэше.
+        """
+        now_wall, now = time.time(), time.monotonic()
+        for url, entry in sorted(entries.items(), key=lambda item: item[1]["fetched_at"]):
+            policy = self.policy_for(url)
+            if policy is None or url in self._entries[policy[0]]:
+                continue
+            age = max(0.0, now_wall - entry["fetched_at"])
+            self._entries[policy[0]][url] = (entry["payload"], now - age)
+        for policy in self.policies:
+            self._trim(policy)
+        return self.size()
+
+    def size(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def format_stats(self):
+        lines = [f"{name}: {value}" for name, value in self.stats.items()]
+        lines.append(f"entries: {self.size()}")
+        lines.append(f"inflight: {len(self._inflight)}")
+        return "\n".join(lines)
+
+RESPONSE_CACHE = ResponseCache(CACHE_POLICIES)
+
+async def fetch_json(url):
+    return await RESPONSE_CACHE.get(url, fetch_json_uncached)
+
+async def fetch_json_result(url):
+    return await RESPONSE_CACHE.get_result(url, fetch_json_uncached)
+
+class HeroStore:
+    """JSON героев с CDN, сохранённые на диск; в памяти — разобранные HeroDetails.
+
+    Ответ отдаётся с диска сразу; раз в HERO_REVALIDATE_INTERVAL файл проверяется
+    на CDN условным запросом в фоне. Если CDN недоступен, продолжаем отдавать копию с диска.
+    """
+
+    NAME_RE = re.compile(r'^[A-Za-z0-9_\-]+$')
+
+    def __init__(self, directory, revalidate_interval):
+        self.directory = directory
+        self.revalidate_interval = revalidate_interval
+        self._entries = {}
+        self._inflight = {}
+        self.stats = {"memory": 0, "disk": 0, "not_modified": 0, "downloaded": 0, "errors": 0}
+        self.warmup_task = None
+
+    def _paths(self, name):
+        base = os.path.join(self.directory, f"ru_{name}")
+        return base + ".json", base + ".meta.json"
+
+    async def _read_disk(self, name):
+        data_path, meta_path = self._paths(name)
+        if not os.path.exists(data_path):
+            return None
+        try:
+            async with aiofiles.open(data_path, "r", encoding="utf-8") as f:
+                hero = self._parse(json.loads(await f.read()))
+            meta = {}
+            if os.path.exists(meta_path):
+                async with aiofiles.open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.loads(await f.read())
+        except Exception:
+            logger.exception(f"Не удалось прочитать {data_path}")
+            return None
+        return hero, meta
+
+    @staticmethod
+    def _parse(payload):
+        return parse_hero_details(payload) if payload else None
+
+    async def _write_file(self, path, text):
+        tmp_path = path + ".tmp"
+        async with aiofiles.open(tmp_path, "w", encoding="utf-8") as f:
+            await f.write(text)
+        os.replace(tmp_path, path)
+
+    async def _write_disk(self, name, payload, meta):
+        data_path, meta_path = self._paths(name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if payload is not None:
+                await self._write_file(data_path, json.dumps(payload, ensure_ascii=False))
+            await self._write_file(meta_path, json.dumps(meta))
+        except Exception:
+            logger.exception(f"Не удалось сохранить {data_path}")
+
+    def is_fresh(self, name):
+        entry = self._entries.get(name)
+        return entry is not None and time.time() - entry[1].get("checked_at", 0) < self.revalidate_interval
+
+    async def get(self, name):
+        """Возвращает HeroDetails или None, если героя нет ни на диске, ни на CDN."""
+        if not self.NAME_RE.match(name):
+            return None
+
+        entry = self._entries.get(name)
+        if entry is not None:
+            self.stats["memory"] += 1
+        else:
+            entry = await self._read_disk(name)
+            if entry is not None:
+                self.stats["disk"] += 1
+                self._entries[name] = entry
+
+        if entry is None:
+            return await asyncio.shield(self._start_revalidate(name))
+
+        if not self.is_fresh(name):
+            self._start_revalidate(name)
+        return entry[0]
+
+    def pending_tasks(self):
+        """Прогрев и фоновые проверки на CDN, которые ещё идут."""
+        return [self.warmup_task, *self._inflight.values()]
+
+    def _start_revalidate(self, name):
+        task = self._inflight.get(name)
+        if task is None:
+            task = asyncio.ensure_future(self._revalidate(name))
+            self._inflight[name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+        return task
+
+    async def _revalidate(self, name):
+        hero, meta = self._entries.get(name) or (None, {})
+        url = f"{CDN_HEROES_INFO_URL}ru_{name}.json"
+        status, new_payload, etag, last_modified = await fetch_json_conditional(
+            url, meta.get("etag"), meta.get("last_modified")
+        )
+        if status is None:
+            self.stats["errors"] += 1
+            return hero
+
+        if status == 304:
+            self.stats["not_modified"] += 1
+            new_payload = None
+        else:
+            self.stats["downloaded"] += 1
+            hero = self._parse(new_payload)
+        meta = {"etag": etag, "last_modified": last_modified, "checked_at": time.time()}
+        self._entries[name] = (hero, meta)
+        await self._write_disk(name, new_payload, meta)
+        return hero
+
+    async def warm_up(self, names, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def warm(name):
+            async with semaphore:
+                if await self.get(name) is not None and not self.is_fresh(name):
+                    await asyncio.shield(self._start_revalidate(name))
+
+        await asyncio.gather(*(warm(name) for name in names), return_exceptions=True)
+        logger.info(f"Прогрев героев завершён: {len(names)} героев, {self.stats}")
+
+HERO_STORE = HeroStore(HERO_CACHE_DIR, HERO_REVALIDATE_INTERVAL)
+
+async def warm_up_hero_store():
+    hero_index = await get_hero_index()
+    if hero_index is None:
+        return
+    await HERO_STORE.warm_up(list(hero_index.names), HERO_WARMUP_CONCURRENCY)
+
 # ---------- Handlers ----------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -211,28 +1684,109 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     await update.message.reply_text("Привет! Выберите действие:", reply_markup=markup)
 
+    # Ссылка из inline-режима: t.me/<бот>?start=hero_<имя>
+    if context.args and context.args[0].startswith("hero_"):
+        await send_hero(context, update.effective_chat.id, context.args[0][len("hero_"):])
+
 async def start_dota_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await log_user_message(update.effective_user, "Нажал 'Проверить статистику'")
-    await update.message.reply_text("Введите числовой Dota ID:")
+    await update.message.reply_text("Введите числовой Dota ID (можно несколько через пробел):")
     return GET_DOTA_ID
 
+# Приписка к ответам, собранным из сохранённых данных, пока API недоступен
+STALE_NOTE = "⚠️ Сервер статистики сейчас недоступен, данные могут быть устаревшими."
+
+DOTA_ID_RE = re.compile(r"\d+")
+# Общий на всех пользователей лимит одновременных запросов статистики к API
+PLAYER_LOOKUP_SLOTS = asyncio.Semaphore(STATS_CONCURRENCY)
+
+def parse_dota_ids(text):
+    """Числовые ID из текста без повторов, в порядке появления."""
+    return list(dict.fromkeys(DOTA_ID_RE.findall(text or "")))
+
+async def fetch_player(dota_id):
+    """Возвращает (данные игрока или None, имя в Steam или None, данные устарели).
+
+    Ответы кэшируются по ID.
+    """
+    async with PLAYER_LOOKUP_SLOTS:
+        player_result, steam_profile_result = await asyncio.gather(
+            fetch_json_result(f"{API_PLAYERS_URL}?playerId={dota_id}"),
+            fetch_json_result(f"{API_STEAM_PROFILE_URL}?playerId={dota_id}")
+        )
+    player_data, steam_profile_data = player_result.data, steam_profile_result.data
+    player_info = player_data.get("data") if player_data else None
+    player_name = None
+    if steam_profile_data and steam_profile_data.get("data"):
+        player_name = steam_profile_data.get("data").get("personaname")
+    return player_info, player_name, player_result.stale
+
+def _cell(value, width, right=False):
+    text = str(value)[:width]
+    return text.rjust(width) if right else text.ljust(width)
+
+def render_stats_table(results):
+    """Компактная таблица статистики нескольких игроков в блоке ``` для MarkdownV2."""
+    lines = [
+        f"{_cell('ID', 10)} {_cell('Игрок', 14)} {_cell('Рейт', 5, True)} "
+        f"{_cell('Игр', 5, True)} {_cell('Ср.м', 4, True)} {_cell('1-х', 4, True)}"
+    ]
+    for dota_id, player_info, player_name, _ in results:
+        if not player_info:
+            lines.append(f"{_cell(dota_id, 10)} не найден")
+            continue
+        lines.append(
+            f"{_cell(dota_id, 10)} {_cell(player_name or '—', 14)} "
+            f"{_cell(player_info.get('rating', '?'), 5, True)} "
+            f"{_cell(player_info.get('matchCount', '?'), 5, True)} "
+            f"{_cell(round(player_info.get('avgPlace', 0), 2), 4, True)} "
+            f"{_cell(player_info.get('firstPlaces', '?'), 4, True)}"
+        )
+    body = "\n".join(lines).replace("\\", "\\\\").replace("`", "\\`")
+    return f"```\n{body}\n```"
+
+async def reply_stats_table(update: Update, dota_ids):
+    results = await asyncio.gather(*(fetch_player(dota_id) for dota_id in dota_ids))
+    table = render_stats_table((dota_id, *result) for dota_id, result in zip(dota_ids, results))
+    if any(stale for _, _, stale in results):
+        table += f"\n{escape_markdown_v2(STALE_NOTE)}"
+    for message in pack_markdown_v2(table):
+        await update.message.reply_text(message, parse_mode='MarkdownV2')
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    dota_ids = parse_dota_ids(" ".join(context.args))
+    await log_user_message(update.effective_user, f"/stats {' '.join(dota_ids)}")
+    if not dota_ids:
+        await update.message.reply_text("Использование: /stats <Dota ID> [<Dota ID> ...]")
+        return
+    if len(dota_ids) > STATS_MAX_IDS:
+        await update.message.reply_text(f"За раз можно проверить не больше {STATS_MAX_IDS} игроков.")
+        return
+    await reply_stats_table(update, dota_ids)
+
 async def get_dota_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    dota_id = update.message.text
-    await log_user_message(update.effective_user, f"Ввел ID: {dota_id}")
+    await log_user_message(update.effective_user, f"Ввел ID: {update.message.text}")
+    dota_ids = parse_dota_ids(update.message.text)
 
-    player_data_url = f"{API_PLAYERS_URL}?playerId={dota_id}"
-    steam_profile_url = f"{API_STEAM_PROFILE_URL}?playerId={dota_id}"
-    
-    player_data, steam_profile_data = await asyncio.gather(
-        fetch_json(player_data_url),
-        fetch_json(steam_profile_url)
-    )
+    if not dota_ids:
+        await update.message.reply_text("Не нашёл в сообщении числового Dota ID. Попробуйте ещё раз или /cancel.")
+        return GET_DOTA_ID
+
+    if len(dota_ids) > STATS_MAX_IDS:
+        await update.message.reply_text(f"За раз можно проверить не больше {STATS_MAX_IDS} игроков.")
+        return GET_DOTA_ID
 
-    if not player_data or not player_data.get("data"):
+    if len(dota_ids) > 1:
+        await reply_stats_table(update, dota_ids)
+        return ConversationHandler.END
+
+    dota_id = dota_ids[0]
+    player_info, player_name, stale = await fetch_player(dota_id)
+
+    if not player_info:
         await update.message.reply_text("Игрок с таким ID не найден или произошла ошибка API.")
         return ConversationHandler.END
 
-    player_info = player_data.get("data")
     match_count = player_info.get("matchCount", "неизвестно")
     avg_place = round(player_info.get("avgPlace", 0), 2)
     first_places = player_info.get("firstPlaces", "неизвестно")
@@ -248,10 +1802,6 @@ async def get_dota_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     is_youtube_live = social_data.get("isYoutubeLive")
     is_twitch_live = social_data.get("isTwitchLive")
 
-    player_name = None
-    if steam_profile_data and steam_profile_data.get("data"):
-        player_name = steam_profile_data.get("data").get("personaname")
-
     if player_name:
         header = f"*Статистика игрока {escape_markdown_v2(player_name)}*"
     else:
@@ -273,6 +1823,9 @@ async def get_dota_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if twitch_url:
         twitch_status = EMOJI_MAP.get("online") if is_twitch_live else EMOJI_MAP.get("offline")
         msg += f"\n{twitch_status} [{escape_markdown_v2('Твич')}]({escape_markdown_v2(twitch_url)})"
+
+    if stale:
+        msg += f"\n\n{escape_markdown_v2(STALE_NOTE)}"
         
     await update.message.reply_text(msg, parse_mode='MarkdownV2')
 
@@ -287,172 +1840,731 @@ async def get_dota_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     return ConversationHandler.END
 
-async def cancel_dota_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Действие отменено.")
-    return ConversationHandler.END
+async def cancel_dota_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Действие отменено.")
+    return ConversationHandler.END
+
+def leaving_dota_stats(callback):
+    """Кнопка меню вместо Dota ID: выходим из диалога и выполняем то, что просили."""
+
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await callback(update, context)
+        return ConversationHandler.END
+
+    return wrapper
+
+def _section(lines):
+    """Склеивает строки раздела, отбрасывая пустые."""
+    return "".join(line + "\n" for line in lines if line.strip())
+
+def update_header(patch):
+    return f"*{escape_markdown_v2(patch.title or 'Без названия')}*\n"
+
+def split_update_parts(patch):
+    """Делит обновление на независимые части: общие изменения, предметы, затем по герою."""
+    parts = []
+    if patch.rows:
+        parts.append(("rows", (patch.change_type, patch.rows)))
+    if patch.items:
+        parts.append(("items", patch.items))
+    parts.extend(("hero", hero) for hero in patch.heroes)
+    return parts
+
+def _change_lines(change_type, rows, indent=" "):
+    change_emoji = get_change_emoji(change_type)
+    for line in rows.split("\n"):
+        if line:
+            yield f"{indent}{change_emoji} {escape_markdown_v2(format_text_with_emojis(line))}"
+
+def render_update_part(part):
+    """Рендерит одну часть обновления в MarkdownV2-раздел (пустая строка, если выводить нечего)."""
+    kind, payload = part
+    if kind == "rows":
+        # Обработка общих изменений
+        return _section(_change_lines(*payload))
+
+    if kind == "items":
+        output = [f"*{escape_markdown_v2('Корректировки Предметов')}*"]
+        for item in payload:
+            item_name = (item.name or 'Неизвестный предмет').replace("_", " ")
+            output.append(f"• *{escape_markdown_v2(item_name.capitalize())}*")
+            output.extend(_change_lines(item.change_type, item.rows))
+        return _section(output)
+
+    return _section(_render_hero_update(payload))
+
+def iter_update_sections(patch):
+    """Отдаёт готовые MarkdownV2-разделы обновления по одному на часть.
+
+    Заголовок приклеивается к первому непустому разделу; если изменений нет, не отдаётся ничего.
+    """
+    header = update_header(patch)
+    for part in split_update_parts(patch):
+        section = render_update_part(part)
+        if not section:
+            continue
+        if header:
+            section, header = header + section, ""
+        yield section
+
+def render_update_batch(parts):
+    """Рендерит пачку частей и сразу разбирает текст на лексемы упаковщика.
+
+    Не трогает состояние бота, поэтому выполняется в пуле рендера.
+    """
+    return MarkdownV2Packer.tokenize("".join(render_update_part(part) for part in parts))
+
+UPGRADE_TITLES = {"scepter": "Аганим", "shard": "Аганим шард"}
+
+def _render_hero_update(hero):
+    hero_name = hero.name or 'Неизвестный герой'
+    yield f"*{escape_markdown_v2(f'Изменения для {hero_name}')}*"
+    yield from _change_lines(hero.change_type, hero.rows)
+
+    for upgrade in hero.upgrades:
+        upgrade_title = UPGRADE_TITLES.get(upgrade.kind, "Неизвестное улучшение")
+        yield f"• {EMOJI_MAP.get(upgrade.kind, '✨')} *{escape_markdown_v2(upgrade_title)}*"
+        yield from _change_lines(upgrade.change_type, upgrade.rows, "  ")
+
+    if hero.talents:
+        yield "*Таланты героя*"
+        for talent in hero.talents:
+            talent_type_emoji = EMOJI_MAP.get(talent.tier) if talent.tier else ""
+
+            display_name = ""
+            skill_emoji = ""
+            if talent.name.lower() == "hero_talent":
+                display_name = "Талант героя"
+            else:
+                skill_emoji = SKILL_EMOJI_MAP.get(talent.name.lower().replace(" ", "_"), "✨")
+                display_name = talent.name.capitalize()
+
+            if display_name:
+                yield f"{talent_type_emoji} {skill_emoji} *{escape_markdown_v2(display_name)}*"
+            yield from _change_lines(talent.change_type, talent.rows)
+
+class RenderedUpdate:
+    """Сообщения патча, которые появляются по мере рендера.
+
+    Читатели получают готовые сообщения через stream(), не дожидаясь конца рендера.
+    failed выставляется, если API не вернул данные обновления.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.done = False
+        self.failed = False
+        self.error = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def publish(self, messages):
+        if messages:
+            self.messages.extend(messages)
+            self._notify()
+
+    def close(self):
+        self.done = True
+        self._notify()
+
+    def _notify(self):
+        # Каждое ожидание держит своё событие, поэтому будим всех и заводим новое
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def stream(self):
+        index = 0
+        while True:
+            if index < len(self.messages):
+                yield self.messages[index]
+                index += 1
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._changed.wait()
+
+    async def result(self):
+        """Дожидается конца рендера. Список сообщений или None при ошибке API."""
+        async for _ in self.stream():
+            pass
+        return None if self.failed else self.messages
+
+# Рендеры обновлений по slug; хранится только последний патч
+RENDERED_UPDATES = {}
+
+async def _render_update(update_url_slug, rendered):
+    try:
+        api_data = await fetch_json(f"{API_UPDATE_DETAILS_URL}{update_url_slug}")
+        if not api_data or not api_data.get("data"):
+            rendered.failed = True
+            return
+        patch = parse_patch(api_data["data"])
+        parts = split_update_parts(patch)
+        header = MarkdownV2Packer.tokenize(update_header(patch))
+        packer = MarkdownV2Packer()
+        # Рендер идёт пачками в пуле; готовые сообщения уходят, пока рендерится остальное
+        for start in range(0, len(parts), RENDER_BATCH_SIZE):
+            tokens = await RENDER_POOL.run(render_update_batch, parts[start:start + RENDER_BATCH_SIZE])
+            if not tokens:
+                continue
+            if header:
+                tokens, header = header + tokens, None
+            rendered.publish(packer.feed_tokens(tokens))
+        rendered.publish(packer.finish())
+    except Exception as e:
+        logger.exception(f"Ошибка рендера обновления {update_url_slug}")
+        rendered.error = e
+    finally:
+        if (rendered.failed or rendered.error is not None) and RENDERED_UPDATES.get(update_url_slug) is rendered:
+            RENDERED_UPDATES.pop(update_url_slug, None)
+        rendered.close()
+
+def get_rendered_update(update_url_slug):
+    """Возвращает рендер обновления, запуская его при первом запросе slug.
+
+    Рендер выполняется один раз на slug, одновременные запросы читают общий результат.
+    """
+    rendered = RENDERED_UPDATES.get(update_url_slug)
+    if rendered is None:
+        # Вышел новый патч: старые рендеры больше не нужны
+        RENDERED_UPDATES.clear()
+        rendered = RenderedUpdate()
+        RENDERED_UPDATES[update_url_slug] = rendered
+        rendered.task = asyncio.ensure_future(_render_update(update_url_slug, rendered))
+    return rendered
+
+async def get_update_messages(update_url_slug):
+    """Возвращает список сообщений обновления (None при ошибке API)."""
+    return await get_rendered_update(update_url_slug).result()
+
+async def handle_updates_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    await log_user_message(user, "Обновления")
+    sent_message = await update.message.reply_text("🔎 Ищу последнее обновление...")
+
+    latest_update_info, stale = await fetch_json_result(API_UPDATES_URL)
+    if not latest_update_info or not latest_update_info.get("data", {}).get("values"):
+        await sent_message.edit_text("Не удалось получить информацию об обновлениях с API. Попробуйте позже.")
+        return
+    # Кнопка «Предыдущие обновления» ведёт в историю — догружаем её и там, где нет задачи JobQueue
+    PATCH_HISTORY.start_refresh(latest_update_info["data"]["values"])
+
+    update_url_slug = latest_update_info["data"]["values"][0].get("url")
+    if not update_url_slug:
+        await sent_message.edit_text("В полученных данных нет ссылки на обновление. Попробуйте позже.")
+        return
+
+    update_url = urljoin(BASE_URL, f"/updates/{update_url_slug}")
+
+    kb = [[
+        InlineKeyboardButton("Источник", web_app=WebAppInfo(url=update_url)),
+        InlineKeyboardButton("Все обновления", web_app=WebAppInfo(url=urljoin(BASE_URL, "/updates")))
+    ], [
+        InlineKeyboardButton("📜 Предыдущие обновления", callback_data="patches")
+    ]]
+    markup = InlineKeyboardMarkup(kb)
+
+    # Сообщения уходят по мере рендера; одно придерживаем, чтобы кнопки попали на последнее
+    rendered = get_rendered_update(update_url_slug)
+    pending = None
+    async for message in rendered.stream():
+        if pending is not None:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=pending, parse_mode='MarkdownV2')
+        pending = message
+
+    if rendered.failed:
+        await sent_message.edit_text("Произошла ошибка при получении данных об обновлении. Попробуйте позже.")
+        return
+
+    if pending is None:
+        await sent_message.edit_text("Не удалось получить данные об изменениях. Возможно, раздел пуст.")
+        return
+
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=pending,
+        parse_mode='MarkdownV2',
+        reply_markup=markup
+    )
+
+    # Список патчей мог устареть: вместо удаления статусного сообщения оставляем в нём предупреждение
+    if stale:
+        await sent_message.edit_text(STALE_NOTE)
+    else:
+        await sent_message.delete()
+    return ConversationHandler.END
+
+
+# ---------- Подписка на обновления ----------
+class SubscriptionStore:
+    """Чаты, подписанные на новые патчи, и последний разосланный slug."""
+
+    def __init__(self, path):
+        self.path = path
+        self.chats = set()
+        self.last_slug = None
+        self._save_lock = asyncio.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.chats = set(data.get("chats", []))
+            self.last_slug = data.get("last_slug")
+        except Exception:
+            logger.exception("Не удалось прочитать файл подписчиков")
+
+    async def save(self):
+        # /subscribe из разных чатов выполняются параллельно: записи идут по одной,
+        # а файл подменяется целиком, чтобы load() не увидел смесь двух версий
+        async with self._save_lock:
+            data = {"chats": sorted(self.chats), "last_slug": self.last_slug}
+            tmp_path = self.path + ".tmp"
+            try:
+                async with aiofiles.open(tmp_path, "w", encoding="utf-8") as f:
+                    await f.write(json.dumps(data))
+                os.replace(tmp_path, self.path)
+            except Exception:
+                logger.exception("Не удалось сохранить файл подписчиков")
+
+SUBSCRIPTIONS = SubscriptionStore(SUBSCRIBERS_FILE)
+
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await log_user_message(update.effective_user, "/subscribe")
+    SUBSCRIPTIONS.chats.add(update.effective_chat.id)
+    await SUBSCRIPTIONS.save()
+    await update.message.reply_text("Готово! Я пришлю сюда следующее обновление, как только оно выйдет. Отписаться: /unsubscribe")
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await log_user_message(update.effective_user, "/unsubscribe")
+    SUBSCRIPTIONS.chats.discard(update.effective_chat.id)
+    await SUBSCRIPTIONS.save()
+    await update.message.reply_text("Вы отписались от уведомлений об обновлениях.")
+
+# BadRequest, после которых чат считается недоступным; остальные — ошибки в самом сообщении
+CHAT_GONE_ERRORS = ("chat not found", "chat was deactivated")
+
+async def send_patch_to_chat(bot, chat_id, messages, markup):
+    """Отправляет патч в один чат. Возвращает False, если чат больше недоступен."""
+    texts = ["🆕 *Вышло новое обновление\\!*"] + messages
+    for i, text in enumerate(texts):
+        try:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                parse_mode='MarkdownV2',
+                reply_markup=markup if i == len(texts) - 1 else None,
+                rate_limit_args={"priority": PRIORITY_BULK},
+            )
+        except Forbidden as e:
+            logger.info(f"Чат {chat_id} удалён из подписчиков: {e}")
+            return False
+        except BadRequest as e:
+            if any(reason in e.message.lower() for reason in CHAT_GONE_ERRORS):
+                logger.info(f"Чат {chat_id} удалён из подписчиков: {e}")
+                return False
+            # Ошибка в нашем сообщении (разметка, длина) — подписчика не трогаем
+            logger.error(f"Чат {chat_id}: сообщение {i + 1} из {len(texts)} не отправлено: {e}")
+        except RetryAfter:
+            logger.error(f"Не удалось отправить обновление в чат {chat_id}")
+            return True
+    return True
+
+async def broadcast_patch(bot, update_url_slug, messages):
+    update_url = urljoin(BASE_URL, f"/updates/{update_url_slug}")
+    markup = InlineKeyboardMarkup([[
+        InlineKeyboardButton("Источник", url=update_url),
+        InlineKeyboardButton("Все обновления", url=urljoin(BASE_URL, "/updates")),
+    ]])
 
-async def handle_updates_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    await log_user_message(user, "Обновления")
-    sent_message = await update.message.reply_text("🔎 Ищу последнее обновление...")
+    chats = sorted(SUBSCRIPTIONS.chats)
+    results = await asyncio.gather(
+        *(send_patch_to_chat(bot, chat_id, messages, markup) for chat_id in chats),
+        return_exceptions=True,
+    )
+    gone = [chat_id for chat_id, ok in zip(chats, results) if ok is False]
+    for chat_id, result in zip(chats, results):
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка рассылки в чат {chat_id}: {result}")
+    if gone:
+        SUBSCRIPTIONS.chats.difference_update(gone)
+        await SUBSCRIPTIONS.save()
+    logger.info(f"Обновление {update_url_slug} разослано в {len(chats) - len(gone)} чатов")
 
-    latest_update_info = await fetch_json(API_UPDATES_URL)
+async def check_for_new_patch(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: один опрос списка обновлений за интервал вместо опросов пользователями."""
+    latest_update_info = await fetch_json_uncached(API_UPDATES_URL)
     if not latest_update_info or not latest_update_info.get("data", {}).get("values"):
-        await sent_message.edit_text("Не удалось получить информацию об обновлениях с API. Попробуйте позже.")
         return
+    RESPONSE_CACHE.put(API_UPDATES_URL, latest_update_info)
 
     update_url_slug = latest_update_info["data"]["values"][0].get("url")
-    if not update_url_slug:
-        await sent_message.edit_text("В полученных данных нет ссылки на обновление. Попробуйте позже.")
+    if not update_url_slug or update_url_slug == SUBSCRIPTIONS.last_slug:
         return
 
-    update_url = urljoin(BASE_URL, f"/updates/{update_url_slug}")
-    api_update_url = f"https://stats.dota1x6.com/api/v2/updates/{update_url_slug}"
-    
-    api_data = await fetch_json(api_update_url)
-    if not api_data or not api_data.get("data"):
-        await sent_message.edit_text("Произошла ошибка при получении данных об обновлении. Попробуйте позже.")
+    first_run = SUBSCRIPTIONS.last_slug is None
+    messages = await get_update_messages(update_url_slug)
+    if messages is None:
         return
+    SUBSCRIPTIONS.last_slug = update_url_slug
+    await SUBSCRIPTIONS.save()
 
-    data = api_data.get("data")
-    title = data.get("ruName", "Без названия")
-    output_text = f"*{escape_markdown_v2(title)}*\n\n"
-    
-    # Обработка общих изменений
-    if data.get("ruRows"):
-        lines = data["ruRows"].split('\n')
-        change_emoji = get_change_emoji(data.get("changeType", ""))
-        for line in lines:
-            line = line.strip()
-            if line:
-                output_text += f" {change_emoji} {escape_markdown_v2(format_text_with_emojis(line))}\n"
-        output_text += "\n"
-        
-    items = data.get("items", [])
-    if items:
-        output_text += f"*{escape_markdown_v2('Корректировки Предметов')}*\n"
-        for item in items:
-            ru_rows = item.get("ruRows")
-            if ru_rows:
-                item_name = item.get('name', 'Неизвестный предмет').replace("_", " ")
-                output_text += f"\n• *{escape_markdown_v2(item_name.capitalize())}*\n"
-                
-                change_emoji = get_change_emoji(item.get("changeType", ""))
-                lines = [line.strip() for line in ru_rows.split('\n') if line.strip()]
-                for line in lines:
-                    output_text += f" {change_emoji} {escape_markdown_v2(format_text_with_emojis(line))}\n"
-
-    heroes = data.get("heroes", [])
-    if heroes:
-        for hero in heroes:
-            hero_name = hero.get('userFriendlyName') or hero.get('userFrendlyName') or 'Неизвестный герой'
-            output_text += f"\n*{escape_markdown_v2(f'Изменения для {hero_name}')}*\n"
-            
-            if hero.get("ruRows"):
-                rows_text = hero['ruRows']
-                lines = [line.strip() for line in rows_text.split('\n') if line.strip()]
-                change_emoji = get_change_emoji(hero.get("changeType", ""))
-                for line in lines:
-                    output_text += f" {change_emoji} {escape_markdown_v2(format_text_with_emojis(line))}\n"
-                output_text += "\n"
-
-            upgrades = hero.get("upgrades", [])
-            if upgrades:
-                for upgrade in upgrades:
-                    if upgrade.get("ruRows"):
-                        upgrade_type = upgrade.get("type", "").lower()
-                        upgrade_title = "Неизвестное улучшение"
-                        if upgrade_type == 'scepter':
-                            upgrade_title = "Аганим"
-                        elif upgrade_type == 'shard':
-                            upgrade_title = "Аганим шард"
-                        
-                        output_text += f"\n• {EMOJI_MAP.get(upgrade_type, '✨')} *{escape_markdown_v2(upgrade_title)}*\n"
-                        
-                        change_emoji = get_change_emoji(upgrade.get("changeType", ""))
-                        lines = [line.strip() for line in upgrade['ruRows'].split('\n') if line.strip()]
-                        for line in lines:
-                             output_text += f"  {change_emoji} {escape_markdown_v2(format_text_with_emojis(line))}\n"
-
-            talents = hero.get("talents", [])
-            if talents:
-                output_text += "\n*Таланты героя*\n"
-                for talent in talents:
-                    talent_name = talent.get('name', '')
-                    
-                    talent_type_emoji = ""
-                    if talent.get("orangeRuRows"):
-                        talent_type_emoji = EMOJI_MAP.get("orange")
-                    elif talent.get("purpleRuRows"):
-                        talent_type_emoji = EMOJI_MAP.get("purple")
-                    elif talent.get("blueRuRows"):
-                        talent_type_emoji = EMOJI_MAP.get("blue")
-
-                    display_name = ""
-                    skill_emoji = ""
-                    if talent_name.lower() == "hero_talent":
-                        display_name = "Талант героя"
-                    else:
-                        skill_emoji = SKILL_EMOJI_MAP.get(talent_name.lower().replace(" ", "_"), "✨")
-                        display_name = talent_name.capitalize()
-
-                    if display_name:
-                        output_text += f"\n{talent_type_emoji} {skill_emoji} *{escape_markdown_v2(display_name)}*\n"
-
-                    talent_rows = [
-                        ("abilityRuRows", ""),
-                        ("orangeRuRows", EMOJI_MAP.get("orange", "")),
-                        ("purpleRuRows", EMOJI_MAP.get("purple", "")),
-                        ("blueRuRows", EMOJI_MAP.get("blue", ""))
-                    ]
-                    
-                    for row_key, emoji_prefix in talent_rows:
-                        if talent.get(row_key):
-                            rows_text = talent[row_key]
-                            lines = [line.strip() for line in rows_text.split('\n') if line.strip()]
-                            for line in lines:
-                                change_emoji = get_change_emoji(talent.get("changeType", ""))
-                                output_text += f" {change_emoji} {escape_markdown_v2(format_text_with_emojis(line))}\n"
-                            output_text += "\n"
+    # При первом запуске только запоминаем текущий патч, чтобы не разослать старый
+    if first_run or not messages or not SUBSCRIPTIONS.chats:
+        return
+    await broadcast_patch(context.bot, update_url_slug, messages)
 
+# ---------- История патчей ----------
+class PatchHistory:
+    """Детали всех виденных обновлений с индексами по героям, предметам и талантам.
 
-    final_text = output_text.strip()
-    
-    if not final_text or final_text.strip() == f"*{escape_markdown_v2(title)}*":
-        await sent_message.edit_text("Не удалось получить данные об изменениях. Возможно, раздел пуст.")
+    Пополняется инкрементально: при синхронизации скачиваются только новые slug. Детали
+    хранятся в снимке состояния (если он включён), индексы собираются в памяти при загрузке.
+    Пополняет её не рассылка, а своя задача и обработчики, поэтому история есть на каждой реплике.
+    """
+
+    def __init__(self, concurrency):
+        self.store = None
+        self.patches = {}
+        self.heroes = defaultdict(list)
+        self.items = defaultdict(list)
+        self.talents = defaultdict(list)
+        self._next_seq = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._sync_lock = asyncio.Lock()
+        self._refresh_task = None
+
+    async def load(self, store):
+        self.store = store
+        if store is None:
+            return
+        for slug, record in (await store.read("patch_history")).items():
+            self._add(slug, record["seq"], parse_patch(record["data"]))
+        logger.info(f"История патчей: загружено {len(self.patches)}")
+
+    def _add(self, slug, seq, patch):
+        self.patches[slug] = (seq, patch)
+        self._next_seq = max(self._next_seq, int(seq) + 1)
+        for item in patch.items:
+            key = normalize_search_text(item.name)
+            if key:
+                self.items[key].append((seq, slug, item))
+        for hero in patch.heroes:
+            for key in {normalize_search_text(hero.name), normalize_search_text(hero.api)}:
+                if key:
+                    self.heroes[key].append((seq, slug, hero))
+            for talent in hero.talents:
+                key = normalize_search_text(talent.name)
+                if key and key != "hero talent":
+                    self.talents[key].append((seq, slug, hero.name, talent))
+
+    async def sync(self, values):
+        """Догружает детали обновлений из списка API_UPDATES_URL (новые — первыми), которых ещё нет."""
+        async with self._sync_lock:
+            slugs = [value["url"] for value in values if value.get("url")]
+            new_slugs = [slug for slug in slugs if slug not in self.patches]
+            if not new_slugs:
+                return 0
+            seqs = self._order(slugs)
+            results = await asyncio.gather(*(self._fetch(slug) for slug in new_slugs))
+            added = 0
+            for slug, data in zip(new_slugs, results):
+                if data is None:
+                    continue
+                self._add(slug, seqs[slug], parse_patch(data))
+                added += 1
+                if self.store is not None:
+                    await self.store.put("patch_history", slug, {"seq": seqs[slug], "data": data})
+            logger.info(f"История патчей: добавлено {added} из {len(new_slugs)}")
+            return added
+
+    def _order(self, slugs):
+        """Номера ещё не загруженных slug по их месту в списке API (от новых к старым).
+
+        Номер берётся между номерами соседних уже загруженных патчей, а не по времени загрузки:
+        патч, который не скачался в прошлый раз, не должен оказаться новее всех.
+        """
+        seqs = {}
+        # Патчи, выпавшие из списка, старше всех в нём
+        listed = set(slugs)
+        older = max((seq for slug, (seq, _) in self.patches.items() if slug not in listed), default=None)
+        for i in range(len(slugs) - 1, -1, -1):
+            slug = slugs[i]
+            if slug in self.patches:
+                older = self.patches[slug][0]
+                continue
+            newer = next((self.patches[s][0] for s in reversed(slugs[:i]) if s in self.patches), None)
+            if newer is None:
+                seq = self._next_seq if older is None else max(self._next_seq, older + 1)
+            elif older is None:
+                seq = newer - 1
+            else:
+                seq = (older + newer) / 2
+            seqs[slug] = older = seq
+        return seqs
+
+    async def refresh(self, values=None):
+        """sync() по списку обновлений; без values список берётся из API_UPDATES_URL. Ошибки только логируются."""
+        try:
+            if values is None:
+                latest_update_info = await fetch_json(API_UPDATES_URL)
+                values = (latest_update_info or {}).get("data", {}).get("values")
+            if values:
+                await self.sync(values)
+        except Exception:
+            logger.exception("Не удалось обновить историю патчей")
+
+    def pending_tasks(self):
+        return [self._refresh_task]
+
+    def start_refresh(self, values=None):
+        """Запускает refresh() в фоне, если он ещё не идёт: для реплик без JobQueue."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh(values))
+
+    async def _fetch(self, slug):
+        # Мимо кэша ответов: история хранит свои записи, вторая сырая копия в памяти не нужна
+        async with self._slots:
+            api_data = await fetch_json_uncached(f"{API_UPDATE_DETAILS_URL}{slug}")
+        if not api_data or not api_data.get("data"):
+            return None
+        return api_data["data"]
+
+    def title(self, slug):
+        return self.patches[slug][1].title or slug
+
+    def newest(self, limit):
+        """Slug обновлений от новых к старым."""
+        return sorted(self.patches, key=lambda slug: self.patches[slug][0], reverse=True)[:limit]
+
+    def _lookup(self, key, hero_keys):
+        """Находит (вид, ключ индекса): точное имя, затем герой из поиска по индексу героев,
+        затем совпадение с началом слова."""
+        indexes = (("hero", self.heroes), ("item", self.items), ("talent", self.talents))
+        for kind, index in indexes:
+            if key in index:
+                return kind, key
+        for hero_key in hero_keys:
+            if hero_key in self.heroes:
+                return "hero", hero_key
+        for kind, index in indexes:
+            matches = sorted(name for name in index if f" {key}" in f" {name}")
+            if matches:
+                return kind, matches[0]
+        return None, None
+
+    def find(self, query, hero_names=()):
+        """Ищет героя, предмет или талант. Возвращает (заголовок, [(заголовок патча, часть)]) от новых к старым."""
+        key = normalize_search_text(query)
+        if not key:
+            return None, []
+        kind, index_key = self._lookup(key, [normalize_search_text(name) for name in hero_names])
+
+        if kind == "hero":
+            entries = sorted(self.heroes[index_key], key=lambda entry: entry[0], reverse=True)
+            name = entries[0][2].name or query
+            return f"История изменений: {name}", [(self.title(slug), ("hero", hero)) for _, slug, hero in entries]
+        if kind == "item":
+            entries = sorted(self.items[index_key], key=lambda entry: entry[0], reverse=True)
+            return (
+                f"История изменений: {index_key.capitalize()}",
+                [(self.title(slug), ("items", (item,))) for _, slug, item in entries],
+            )
+        if kind == "talent":
+            entries = sorted(self.talents[index_key], key=lambda entry: entry[0], reverse=True)
+            return (
+                f"История изменений: {index_key.capitalize()}",
+                [
+                    (self.title(slug), ("hero", HeroChange("", hero_name, "", "", (), (talent,))))
+                    for _, slug, hero_name, talent in entries
+                ],
+            )
+        return None, []
+
+PATCH_HISTORY = PatchHistory(PATCH_HISTORY_CONCURRENCY)
+
+async def sync_patch_history(context: ContextTypes.DEFAULT_TYPE):
+    await PATCH_HISTORY.refresh()
+
+def render_history_messages(title, entries):
+    """Сообщения истории: заголовок и раздел из каждого патча, от новых к старым. Выполняется в пуле рендера."""
+    text = f"*{escape_markdown_v2(title)}*\n"
+    for patch_title, part in entries:
+        section = render_update_part(part)
+        if section:
+            text += f"📅 *{escape_markdown_v2(patch_title)}*\n{section}"
+    return pack_markdown_v2(text)
+
+def render_patch_messages(patch):
+    """Все сообщения одного обновления из истории. Выполняется в пуле рендера."""
+    packer = MarkdownV2Packer()
+    messages = []
+    for section in iter_update_sections(patch):
+        messages += packer.feed(section)
+    return messages + packer.finish()
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = " ".join(context.args)
+    await log_user_message(update.effective_user, f"/history {query}")
+    if not query:
+        await update.message.reply_text("Использование: /history <герой, предмет или талант>, например /history pudge")
         return
-        
-    kb = [[
-        InlineKeyboardButton("Источник", web_app=WebAppInfo(url=update_url)),
-        InlineKeyboardButton("Все обновления", web_app=WebAppInfo(url=urljoin(BASE_URL, "/updates")))
-    ]]
-    markup = InlineKeyboardMarkup(kb)
+    if not PATCH_HISTORY.patches:
+        PATCH_HISTORY.start_refresh()
+        await update.message.reply_text("История патчей ещё собирается. Попробуйте через пару минут.")
+        return
+
+    hero_index = await get_hero_index()
+    hero_names = [hero_index.names[api] for api in hero_index.search(query, 3)] if hero_index else []
+    title, entries = PATCH_HISTORY.find(query, hero_names)
+    if not entries:
+        await update.message.reply_text(f"В последних {len(PATCH_HISTORY.patches)} обновлениях нет изменений для «{query}».")
+        return
+
+    messages = await RENDER_POOL.run(render_history_messages, title, entries)
+    for message in messages:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=message, parse_mode='MarkdownV2')
+
+async def handle_patches_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Список сохранённых обновлений (/patches или кнопка под обновлением)."""
+    await log_user_message(update.effective_user, "Список обновлений")
+    slugs = [slug for slug in PATCH_HISTORY.newest(20) if len(f"patch_{slug}".encode()) <= 64]
+    if not slugs:
+        PATCH_HISTORY.start_refresh()
+        text, markup = "История патчей ещё собирается. Попробуйте через пару минут.", None
+    else:
+        text = "Выберите обновление:"
+        markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton(PATCH_HISTORY.title(slug), callback_data=f"patch_{slug}")] for slug in slugs
+        ])
+    if update.callback_query:
+        await update.callback_query.answer()
+        await update.callback_query.message.reply_text(text, reply_markup=markup)
+    else:
+        await update.message.reply_text(text, reply_markup=markup)
+
+async def handle_patch_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    slug = query.data[len("patch_"):]
+    record = PATCH_HISTORY.patches.get(slug)
+    if record is None:
+        await query.message.reply_text("Это обновление не найдено в истории.")
+        return
+    messages = await RENDER_POOL.run(render_patch_messages, record[1])
+    if not messages:
+        await query.message.reply_text("В этом обновлении нет описанных изменений.")
+        return
+    for message in messages:
+        await context.bot.send_message(chat_id=query.message.chat_id, text=message, parse_mode='MarkdownV2')
 
-    message_parts = [part for part in final_text.split('\n') if part.strip()]
-    current_message = ""
+# ---------- Ладдер ----------
+def render_ladder_player(player):
+    player_info = (
+        f"*{escape_markdown_v2(str(player.place))}\\. {escape_markdown_v2(player.nickname)}*\n"
+        f"Рейтинг: {escape_markdown_v2(str(player.rating))}\n"
+        f"Игр: {escape_markdown_v2(str(player.match_count))}\n"
+    )
     
-    for i, part in enumerate(message_parts):
-        if len(current_message) + len(part) + 1 < 4096:
-            current_message += part + "\n"
-        else:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id, 
-                text=current_message, 
-                parse_mode='MarkdownV2'
-            )
-            current_message = part + "\n"
-            
-    if current_message:
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id, 
-            text=current_message, 
-            parse_mode='MarkdownV2',
-            reply_markup=markup
-        )
+    if player.favorite_hero:
+        hero_name = player.favorite_hero.replace("npc_dota_hero_", "").capitalize()
+        player_info += f"Лучший герой: {escape_markdown_v2(hero_name)}\n"
     
-    await sent_message.delete()
-    return ConversationHandler.END
+    social_links = []
+    if player.youtube:
+        yt_status = EMOJI_MAP.get("online") if player.youtube_live else EMOJI_MAP.get("offline")
+        social_links.append(f" {yt_status} [{escape_markdown_v2('Ютуб')}]({escape_markdown_v2(player.youtube)})")
+    if player.twitch:
+        twitch_status = EMOJI_MAP.get("online") if player.twitch_live else EMOJI_MAP.get("offline")
+        social_links.append(f" {twitch_status} [{escape_markdown_v2('Твич')}]({escape_markdown_v2(player.twitch)})")
+    
+    if social_links:
+        player_info += "\\|".join(social_links)
+        player_info += "\n"
+    
+    return player_info + "\n"
+
+class LadderSnapshot:
+    """Снимок ладдера, заранее разбитый на страницы с готовым текстом и клавиатурой."""
+
+    def __init__(self, leaderboard_data, page_size, max_chars=3900):
+        self.source = leaderboard_data
+        # True, если API не ответил и снимок собран из сохранённых данных
+        self.stale = False
+        players = [parse_ladder_player(player) for player in leaderboard_data.get("data") or []]
+
+        bodies = []
+        page_players = []
+        page_body = ""
+        for player in players:
+            player_text = render_ladder_player(player)
+            if page_players and (len(page_players) >= page_size or len(page_body) + len(player_text) > max_chars):
+                bodies.append((page_players, page_body))
+                page_players, page_body = [], ""
+            page_players.append(player)
+            page_body += player_text
+        if page_players:
+            bodies.append((page_players, page_body))
+
+        self.pages = []
+        for page_players, page_body in bodies:
+            first_place = page_players[0].place
+            last_place = page_players[-1].place
+            header = f"*{escape_markdown_v2(f'ЛАДДЕР: места {first_place}–{last_place}')}*\n\n"
+            self.pages.append(header + page_body)
+        self.markups = [self._build_markup(i) for i in range(len(self.pages))]
 
+    def _build_markup(self, page):
+        last = len(self.pages) - 1
+        keyboard = []
+        if last > 0:
+            nav = []
+            if page > 0:
+                nav.append(InlineKeyboardButton("«", callback_data="ladder_page_0"))
+                nav.append(InlineKeyboardButton("‹", callback_data=f"ladder_page_{page - 1}"))
+            nav.append(InlineKeyboardButton(f"{page + 1}/{last + 1}", callback_data="ladder_noop"))
+            if page < last:
+                nav.append(InlineKeyboardButton("›", callback_data=f"ladder_page_{page + 1}"))
+                nav.append(InlineKeyboardButton("»", callback_data=f"ladder_page_{last}"))
+            keyboard.append(nav)
+
+            jumps = []
+            if page - 10 >= 0:
+                jumps.append(InlineKeyboardButton("−10", callback_data=f"ladder_page_{page - 10}"))
+            if page - 5 >= 0:
+                jumps.append(InlineKeyboardButton("−5", callback_data=f"ladder_page_{page - 5}"))
+            if page + 5 <= last:
+                jumps.append(InlineKeyboardButton("+5", callback_data=f"ladder_page_{page + 5}"))
+            if page + 10 <= last:
+                jumps.append(InlineKeyboardButton("+10", callback_data=f"ladder_page_{page + 10}"))
+            if jumps:
+                keyboard.append(jumps)
+        keyboard.append([InlineKeyboardButton("Весь ладдер на сайте", web_app=WebAppInfo(url=f"{BASE_URL}/leaderboard"))])
+        return InlineKeyboardMarkup(keyboard)
+
+    def page(self, number):
+        number = max(0, min(number, len(self.pages) - 1))
+        return self.pages[number], self.markups[number]
+
+LADDER_SNAPSHOT = None
+
+async def get_ladder_snapshot():
+    """Возвращает снимок ладдера, пересобирая страницы только при новом ответе API."""
+    global LADDER_SNAPSHOT
+    leaderboard_data, stale = await fetch_json_result(API_LEADERBOARD_URL)
+    if not leaderboard_data or not leaderboard_data.get("data"):
+        if LADDER_SNAPSHOT is not None:
+            LADDER_SNAPSHOT.stale = True
+        return LADDER_SNAPSHOT
+    if LADDER_SNAPSHOT is None or LADDER_SNAPSHOT.source is not leaderboard_data:
+        LADDER_SNAPSHOT = LadderSnapshot(leaderboard_data, LEADERBOARD_PAGE_SIZE)
+    LADDER_SNAPSHOT.stale = stale
+    return LADDER_SNAPSHOT
 
 async def handle_leaderboard_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -460,65 +2572,164 @@ async def handle_leaderboard_button(update: Update, context: ContextTypes.DEFAUL
 
     sent_message = await update.message.reply_text("🏆 Загружаю ладдер...")
     
-    leaderboard_data = await fetch_json(API_LEADERBOARD_URL)
+    snapshot = await get_ladder_snapshot()
     
-    if not leaderboard_data or not leaderboard_data.get("data"):
+    if snapshot is None or not snapshot.pages:
         await sent_message.edit_text("Не удалось получить данные ладдера. Попробуйте позже.")
         return
-        
-    players = leaderboard_data.get("data")
-    players_to_display = players[:50]
-    
-    message_text = f"*{escape_markdown_v2('ТОП-50 ИГРОКОВ LADDER.')}*\n\n"
-    
-    for player in players_to_display:
-        place = player.get("place")
-        nickname = player.get("nickname")
-        rating = player.get("rating")
-        match_count = player.get("matchCount")
-        favorite_hero = player.get("favoriteHero")
-        
-        social_data = player.get("social", {})
-        if social_data is None:
-            social_data = {}
-        
-        youtube_url = social_data.get("youtube")
-        twitch_url = social_data.get("twitch")
-        is_youtube_live = social_data.get("isYoutubeLive")
-        is_twitch_live = social_data.get("isTwitchLive")
-
-        player_info = (
-            f"*{escape_markdown_v2(str(place))}\\. {escape_markdown_v2(nickname)}*\n"
-            f"Рейтинг: {escape_markdown_v2(str(rating))}\n"
-            f"Игр: {escape_markdown_v2(str(match_count))}\n"
-        )
-        
-        if favorite_hero:
-            hero_name = favorite_hero.replace("npc_dota_hero_", "").capitalize()
-            player_info += f"Лучший герой: {escape_markdown_v2(hero_name)}\n"
-        
-        social_links = []
-        if youtube_url:
-            yt_status = EMOJI_MAP.get("online") if is_youtube_live else EMOJI_MAP.get("offline")
-            social_links.append(f" {yt_status} [{escape_markdown_v2('Ютуб')}]({escape_markdown_v2(youtube_url)})")
-        if twitch_url:
-            twitch_status = EMOJI_MAP.get("online") if is_twitch_live else EMOJI_MAP.get("offline")
-            social_links.append(f" {twitch_status} [{escape_markdown_v2('Твич')}]({escape_markdown_v2(twitch_url)})")
-        
-        if social_links:
-            player_info += "\\|".join(social_links)
-            player_info += "\n"
-        
-        message_text += player_info + "\n"
-        
-    keyboard = [
-        [InlineKeyboardButton("Весь ладдер на сайте", web_app=WebAppInfo(url=f"{BASE_URL}/leaderboard"))]
-    ]
-    
-    markup = InlineKeyboardMarkup(keyboard)
     
+    message_text, markup = snapshot.page(0)
+    if snapshot.stale:
+        message_text += f"\n{escape_markdown_v2(STALE_NOTE)}"
     await sent_message.edit_text(message_text, reply_markup=markup, parse_mode='MarkdownV2', disable_web_page_preview=True)
 
+async def handle_ladder_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if query.data == "ladder_noop":
+        await query.answer()
+        return
+
+    snapshot = await get_ladder_snapshot()
+    if snapshot is None or not snapshot.pages:
+        await query.answer("Не удалось получить данные ладдера. Попробуйте позже.")
+        return
+    await query.answer()
+
+    try:
+        page = int(query.data.rsplit("_", 1)[1])
+    except (IndexError, ValueError):
+        page = 0
+    message_text, markup = snapshot.page(page)
+    try:
+        await query.edit_message_text(message_text, reply_markup=markup, parse_mode='MarkdownV2', disable_web_page_preview=True)
+    except BadRequest as e:
+        # Повторное нажатие на ту же страницу
+        if "not modified" not in str(e).lower():
+            raise
+
+# ---------- Индекс героев ----------
+ATTRIBUTE_TITLES = {"Strength": "Strength", "Agility": "Agility", "Intellect": "Intellect", "All": "Universal"}
+SEARCH_SEPARATOR_RE = re.compile(r"[\W_]+")
+
+def normalize_search_text(text):
+    """Нижний регистр, без префикса npc_dota_hero_, слова через один пробел."""
+    text = text.lower().replace("ё", "е").replace("npc_dota_hero_", "")
+    return " ".join(SEARCH_SEPARATOR_RE.split(text)).strip()
+
+def search_trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class HeroIndex:
+    """Готовые клавиатуры выбора героя по атрибуту, имена героев по API-имени и поиск по ним.
+
+    Строится один раз на каждый новый ответ API_HEROES_URL. Поиск идёт по userFriendlyName
+    и API-имени: сначала совпадение с началом имени, слова в нём или сокращения по первым буквам,
+    затем по триграммам (опечатки).
+    """
+
+    def __init__(self, heroes_data):
+        self.source = heroes_data
+        self.keyboards = {}
+        self.names = {}
+        self.attributes = {}
+        self._exact = {}
+        self._prefixes = {}
+        self._trigrams = defaultdict(set)
+
+        by_attribute = {}
+        for hero in parse_heroes(heroes_data):
+            by_attribute.setdefault(hero.attribute, []).append(hero)
+            self.names[hero.api] = hero.name
+            self.attributes[hero.api] = hero.attribute
+            self._index_hero(hero.api, hero.name)
+
+        # Внутри префикса: совпадения с началом имени раньше совпадений со словом, дальше по алфавиту
+        self._prefixes = {
+            prefix: [api for api, _ in sorted(ranks.items(), key=lambda item: (item[1], self.names[item[0]]))]
+            for prefix, ranks in self._prefixes.items()
+        }
+        self._all = sorted(self.names, key=self.names.get)
+
+        for attribute, attribute_heroes in by_attribute.items():
+            keyboard = []
+            row = []
+            for hero in sorted(attribute_heroes, key=lambda x: x.name):
+                row.append(InlineKeyboardButton(hero.name, callback_data=f"hero_{hero.api}"))
+                if len(row) == 2:
+                    keyboard.append(row)
+                    row = []
+            if row:
+                keyboard.append(row)
+
+            keyboard.append([InlineKeyboardButton("Назад", callback_data="back_to_attributes")])
+            self.keyboards[attribute] = InlineKeyboardMarkup(keyboard)
+
+    def _index_hero(self, api, name):
+        for key in {normalize_search_text(name), normalize_search_text(api)}:
+            if not key:
+                continue
+            self._exact.setdefault(key, api)
+            words = key.split()
+            starts = [key] + [" ".join(words[i:]) for i in range(1, len(words))]
+            for position, start in enumerate(starts):
+                rank = min(position, 1)
+                for end in range(1, len(start) + 1):
+                    ranks = self._prefixes.setdefault(start[:end], {})
+                    ranks[api] = min(ranks.get(api, rank), rank)
+            for trigram in search_trigrams(key):
+                self._trigrams[trigram].add(api)
+            # Сокращения по первым буквам слов: am, qop
+            if len(words) > 1:
+                initials = "".join(word[0] for word in words)
+                self._exact.setdefault(initials, api)
+                for end in range(2, len(initials) + 1):
+                    ranks = self._prefixes.setdefault(initials[:end], {})
+                    ranks.setdefault(api, 1)
+
+    def search(self, query, limit):
+        """API-имена героев, подходящих под запрос, лучшие первыми. Пустой запрос — все по алфавиту."""
+        key = normalize_search_text(query)
+        if not key:
+            return self._all[:limit]
+
+        results = []
+        exact = self._exact.get(key)
+        if exact is not None:
+            results.append(exact)
+        for api in self._prefixes.get(key, ()):
+            if len(results) >= limit:
+                return results
+            if api != exact:
+                results.append(api)
+
+        if len(results) < limit and len(key) >= 3:
+            trigrams = search_trigrams(key)
+            scores = defaultdict(int)
+            for trigram in trigrams:
+                for api in self._trigrams.get(trigram, ()):
+                    scores[api] += 1
+            found = set(results)
+            fuzzy = sorted(
+                (api for api, score in scores.items() if api not in found and score * 2 >= len(trigrams)),
+                key=lambda api: (-scores[api], self.names[api]),
+            )
+            results.extend(fuzzy[:limit - len(results)])
+        return results
+
+HERO_INDEX = None
+
+async def get_hero_index():
+    """Возвращает индекс героев, перестраивая его, только если список героев обновился."""
+    global HERO_INDEX
+    heroes_data = await fetch_json(API_HEROES_URL)
+    if not heroes_data:
+        return HERO_INDEX
+    if HERO_INDEX is None or HERO_INDEX.source is not heroes_data:
+        # Новый индекс собирается целиком и подменяется одним присваиванием
+        HERO_INDEX = HeroIndex(heroes_data)
+    return HERO_INDEX
+
 async def handle_heroes_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     await log_user_message(user, "Герои")
@@ -546,17 +2757,15 @@ async def handle_attribute_selection(update: Update, context: ContextTypes.DEFAU
     attribute = query.data.split("_")[1]
     context.user_data['selected_attribute'] = attribute
     
-    heroes_data = await fetch_json(API_HEROES_URL)
+    hero_index = await get_hero_index()
     
-    if not heroes_data:
+    if hero_index is None:
         await query.message.reply_text("Не удалось получить список героев.")
         return
-        
-    heroes = heroes_data.get("data", {}).get("heroes", [])
     
-    filtered_heroes = [h for h in heroes if h.get("attribute") == attribute]
+    markup = hero_index.keyboards.get(attribute)
     
-    if not filtered_heroes:
+    if markup is None:
         await query.edit_message_text(
             text="К сожалению, героев этого атрибута не найдено. Попробуйте выбрать другой.",
             reply_markup=InlineKeyboardMarkup([
@@ -564,42 +2773,25 @@ async def handle_attribute_selection(update: Update, context: ContextTypes.DEFAU
             ])
         )
         return
-
-    keyboard = []
-    row = []
-    for hero in sorted(filtered_heroes, key=lambda x: x.get("userFriendlyName") or x.get("userFrendlyName", "")):
-        name = hero.get("userFriendlyName") or hero.get("userFrendlyName")
-        hero_name_api = hero.get("name")
-        
-        if name and hero_name_api:
-            row.append(InlineKeyboardButton(name, callback_data=f"hero_{hero_name_api}"))
-            if len(row) == 2:
-                keyboard.append(row)
-                row = []
-    if row:
-        keyboard.append(row)
-    
-    keyboard.append([InlineKeyboardButton("Назад", callback_data="back_to_attributes")])
-    markup = InlineKeyboardMarkup(keyboard)
     
     await query.edit_message_text(
         text="Выберите героя:",
         reply_markup=markup
     )
     
-async def send_hero_details(update: Update, context: ContextTypes.DEFAULT_TYPE, hero_json, hero_name):
+TALENT_TITLES = {"purple": "Эпические таланты", "blue": "Редкие таланты", "orange": "Легендарные таланты"}
+
+def render_hero_messages(hero):
+    """Собирает страницу героя (HeroDetails) и делит её на сообщения. Выполняется в пуле рендера."""
     text_parts = []
     
-    text_parts.append(f"*{escape_markdown_v2(hero_name)}*\n")
-    
-    changes = hero_json.get('changes', [])
-    upgrades = hero_json.get('upgrades', [])
+    text_parts.append(f"*{escape_markdown_v2(hero.name)}*\n")
 
-    if changes:
+    if hero.changes:
         text_parts.append(f"*{escape_markdown_v2('Отличия от Dota:')}*")
-        for change in changes:
-            name = change.get('name')
-            description = change.get('description', '')
+        for change in hero.changes:
+            name = change.name
+            description = change.description
             
             if name == 'innate':
                 text_parts.append("")
@@ -628,12 +2820,12 @@ async def send_hero_details(update: Update, context: ContextTypes.DEFAULT_TYPE,
                     text_parts.append(f"• _{escape_markdown_v2(formatted_desc)}_")
         text_parts.append("")
     
-    if upgrades:
+    if hero.upgrades:
         text_parts.append("*Улучшения:*")
         
         grouped_upgrades = {}
-        for upgrade in upgrades:
-            upgrade_type = upgrade.get('upgradeType', 'unknown')
+        for upgrade in hero.upgrades:
+            upgrade_type = upgrade.kind
             if upgrade_type not in grouped_upgrades:
                 grouped_upgrades[upgrade_type] = []
             grouped_upgrades[upgrade_type].append(upgrade)
@@ -655,42 +2847,94 @@ async def send_hero_details(update: Update, context: ContextTypes.DEFAULT_TYPE,
                 text_parts.append(f"• {emoji} *{escape_markdown_v2(upgrade_title)}:*")
                 
                 for upgrade in upgrades_to_print:
-                    description = format_text_with_emojis(upgrade.get('description', ''))
+                    description = format_text_with_emojis(upgrade.description)
                     extra_values_text = ""
-                    for extra_value_pair in upgrade.get('extraValues', []):
-                        key = extra_value_pair[0]
-                        value = extra_value_pair[1]
+                    for key, value in upgrade.extra_values:
                         extra_values_text += f"_{format_text_with_emojis(key)}: {format_text_with_emojis(value)}_\n"
 
                     text_parts.append(f"{escape_markdown_v2(extra_values_text)}{escape_markdown_v2(description)}")
 
         text_parts.append("")
 
-    talents_data = {
-        'purple': {'title': 'Эпические таланты', 'data': hero_json.get('purpleTalents', {})},
-        'blue': {'title': 'Редкие таланты', 'data': hero_json.get('blueTalents', {})},
-        'orange': {'title': 'Легендарные таланты', 'data': hero_json.get('orangeTalents', {})},
-    }
-    
-    for color, info in talents_data.items():
-        if info['data']:
-            text_parts.append(f"*{escape_markdown_v2(info['title'])}:*")
-            talent_emoji = EMOJI_MAP.get(color, "✨")
-            for skill_key, skill_talents in info['data'].items():
-                for talent in skill_talents:
-                    description = talent.get('description', '')
-                    if description:
-                        text_parts.append("")
-                        formatted_desc = format_text_with_emojis(description)
-                        text_parts.append(f"• {talent_emoji} {escape_markdown_v2(formatted_desc)}")
+    for color, descriptions in hero.talents:
+        text_parts.append(f"*{escape_markdown_v2(TALENT_TITLES[color])}:*")
+        talent_emoji = EMOJI_MAP.get(color, "✨")
+        for description in descriptions:
             text_parts.append("")
+            formatted_desc = format_text_with_emojis(description)
+            text_parts.append(f"• {talent_emoji} {escape_markdown_v2(formatted_desc)}")
+        text_parts.append("")
 
     message_text = "\n".join(text_parts).strip()
     
     if not message_text:
         message_text = "Информация по этому герою не найдена."
     
-    await send_long_message(context, update.callback_query.message.chat_id, message_text)
+    return pack_markdown_v2(message_text)
+
+async def send_hero_details(context: ContextTypes.DEFAULT_TYPE, chat_id, hero):
+    messages = await RENDER_POOL.run(render_hero_messages, hero)
+    for message in messages:
+        await context.bot.send_message(chat_id=chat_id, text=message, parse_mode='MarkdownV2')
+
+async def send_hero(context: ContextTypes.DEFAULT_TYPE, chat_id, hero_name_api):
+    """Отправляет страницу героя по API-имени (поиск, /hero и ссылка /start hero_...)."""
+    hero = await HERO_STORE.get(hero_name_api)
+    if hero is None:
+        await context.bot.send_message(chat_id=chat_id, text=f"Не удалось получить данные для героя {hero_name_api}. Попробуйте позже.")
+        return
+    await send_hero_details(context, chat_id, hero)
+
+async def reply_hero_search(update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+    hero_index = await get_hero_index()
+    if hero_index is None:
+        await update.message.reply_text("Не удалось получить список героев.")
+        return
+    found = hero_index.search(text, HERO_SEARCH_LIMIT)
+    if not found:
+        await update.message.reply_text(f"Не нашёл героя «{text}». Попробуйте другое написание или кнопку «Герои».")
+        return
+    if len(found) == 1 or normalize_search_text(text) == normalize_search_text(hero_index.names[found[0]]):
+        await send_hero(context, update.effective_chat.id, found[0])
+        return
+    keyboard = [[InlineKeyboardButton(hero_index.names[api], callback_data=f"hero_{api}")] for api in found]
+    await update.message.reply_text("Нашлось несколько героев:", reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def hero_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = " ".join(context.args)
+    await log_user_message(update.effective_user, f"/hero {text}")
+    if not text:
+        await update.message.reply_text("Использование: /hero <имя героя>, например /hero anti")
+        return
+    await reply_hero_search(update, context, text)
+
+async def handle_hero_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Любой другой текст в личном чате считается поиском героя."""
+    text = update.message.text.strip()
+    await log_user_message(update.effective_user, f"Поиск героя: {text}")
+    await reply_hero_search(update, context, text)
+
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline-режим: @bot <имя героя>. Ответ строится по индексу, без запросов к API на каждую букву."""
+    inline_query = update.inline_query
+    hero_index = await get_hero_index()
+    if hero_index is None:
+        await inline_query.answer([], cache_time=10)
+        return
+
+    results = []
+    for api in hero_index.search(inline_query.query, INLINE_RESULTS_LIMIT):
+        name = hero_index.names[api]
+        results.append(InlineQueryResultArticle(
+            id=api[:64],
+            title=name,
+            description=ATTRIBUTE_TITLES.get(hero_index.attributes.get(api), ""),
+            input_message_content=InputTextMessageContent(f"🦸 {name}"),
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("Подробнее в боте", url=f"https://t.me/{context.bot.username}?start=hero_{api}")
+            ]]),
+        ))
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
 
 async def handle_hero_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -705,21 +2949,18 @@ async def handle_hero_selection(update: Update, context: ContextTypes.DEFAULT_TY
         await query.message.reply_text("Произошла ошибка при обработке данных. Пожалуйста, сообщите об этом разработчику.")
         return
     
-    await query.message.edit_text(f"Загружаю информацию о герое {hero_name_api}...")
+    display_name = HERO_INDEX.names.get(hero_name_api, hero_name_api) if HERO_INDEX else hero_name_api
+    await query.message.edit_text(f"Загружаю информацию о герое {display_name}...")
     
-    full_api_url = f"{CDN_HEROES_INFO_URL}ru_{hero_name_api}.json"
+    hero = await HERO_STORE.get(hero_name_api)
     
-    hero_json_data = await fetch_json(full_api_url)
-    
-    if not hero_json_data:
+    if hero is None:
         await query.message.edit_text(f"Не удалось получить данные для героя {hero_name_api}. Попробуйте позже.")
         return
-        
-    hero_name = hero_json_data.get('userFriendlyName') or hero_json_data.get('userFrendlyName', 'Герой')
 
     await query.message.delete()
     
-    await send_hero_details(update, context, hero_json_data, hero_name)
+    await send_hero_details(context, query.message.chat_id, hero)
     
     keyboard = [
         [InlineKeyboardButton("Назад", callback_data="back_to_attributes")],
@@ -732,27 +2973,562 @@ async def handle_hero_selection(update: Update, context: ContextTypes.DEFAULT_TY
         reply_markup=markup
     )
 
-def main() -> None:
-    application = Application.builder().token(TOKEN).build()
+async def cache_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        return
+    hero_stats = "\n".join(f"hero_{name}: {value}" for name, value in HERO_STORE.stats.items())
+    breaker_stats = "\n".join(
+        f"{host}: {'open' if breaker.is_open else 'closed'}, сбоев подряд {breaker.failures}, отклонено {breaker.rejected}"
+        for host, breaker in BREAKERS.items()
+    )
+    for chunk in split_plain_text(f"{RESPONSE_CACHE.format_stats()}\n{hero_stats}\n{breaker_stats}"):
+        await update.message.reply_text(chunk)
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        return
+    cache_text = "\n".join(f"{metric}{{{labels}}} {value}" for metric, labels, value in cache_counters())
+    # с ростом числа серий отчёт перерастает лимит Telegram — шлём его несколькими сообщениями
+    for chunk in split_plain_text(f"{METRICS.format_text()}\n\n[cache]\n{cache_text}"):
+        await update.message.reply_text(chunk)
+
+# ---------- СНИМОК СОСТОЯНИЯ ----------
+class SnapshotStore:
+    """Локальный снимок состояния в SQLite (режим WAL).
+
+    Хранит JSON-значения по ключу (kind, key). Запросы к базе выполняются в потоке
+    по одному, чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._lock = asyncio.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (kind, key))"
+            )
+            self._db = db
+        return self._db
+
+    def _read(self, kind):
+        rows = self._connect().execute("SELECT key, value FROM state WHERE kind = ?", (kind,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def _replace(self, kind, items):
+        db = self._connect()
+        with db:
+            db.execute("DELETE FROM state WHERE kind = ?", (kind,))
+            db.executemany(
+                "INSERT INTO state (kind, key, value) VALUES (?, ?, ?)",
+                ((kind, key, json.dumps(value, ensure_ascii=False)) for key, value in items.items()),
+            )
+
+    def _put(self, kind, key, value):
+        db = self._connect()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO state (kind, key, value) VALUES (?, ?, ?)",
+                (kind, key, json.dumps(value, ensure_ascii=False)),
+            )
+
+    def _delete(self, kind, key):
+        db = self._connect()
+        with db:
+            db.execute("DELETE FROM state WHERE kind = ? AND key = ?", (kind, key))
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def _run(self, func, *args):
+        async with self._lock:
+            return await asyncio.to_thread(func, *args)
+
+    async def read(self, kind):
+        try:
+            return await self._run(self._read, kind)
+        except (sqlite3.Error, ValueError):
+            logger.exception(f"Не удалось прочитать снимок: {kind}")
+            return {}
+
+    async def replace(self, kind, items):
+        await self._run(self._replace, kind, items)
+
+    async def put(self, kind, key, value):
+        await self._run(self._put, kind, key, value)
+
+    async def delete(self, kind, key):
+        await self._run(self._delete, kind, key)
+
+    async def close(self):
+        await self._run(self._close)
+
+class SnapshotPersistence(BasePersistence):
+    """Persistence для PTB поверх SnapshotStore: user_data, chat_data, bot_data и состояния диалогов."""
+
+    def __init__(self, store, update_interval=60):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.store = store
+
+    async def get_user_data(self):
+        return {int(user_id): data for user_id, data in (await self.store.read("user_data")).items()}
+
+    async def get_chat_data(self):
+        return {int(chat_id): data for chat_id, data in (await self.store.read("chat_data")).items()}
+
+    async def get_bot_data(self):
+        return (await self.store.read("bot_data")).get("bot_data", {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        data = await self.store.read(f"conversation:{name}")
+        return {tuple(json.loads(key)): state for key, state in data.items()}
+
+    async def update_conversation(self, name, key, new_state):
+        key = json.dumps(list(key))
+        if new_state is None:
+            await self.store.delete(f"conversation:{name}", key)
+        else:
+            await self.store.put(f"conversation:{name}", key, new_state)
+
+    async def update_user_data(self, user_id, data):
+        await self.store.put("user_data", str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self.store.put("chat_data", str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        await self.store.put("bot_data", "bot_data", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self.store.delete("user_data", str(user_id))
+
+    async def drop_chat_data(self, chat_id):
+        await self.store.delete("chat_data", str(chat_id))
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        # Каждое изменение уже записано в базу
+        pass
+
+def code_version():
+    """Хеш исходника бота: меняется с любым деплоем, в том числе рендера и упаковщика сообщений."""
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+class WarmSnapshot:
+    """Периодически и при остановке сохраняет кэш ответов API и готовые рендеры патчей,
+    при запуске загружает их обратно. Рендеры от другой версии кода отбрасываются."""
+
+    def __init__(self, store, interval):
+        self.store = store
+        self.interval = interval
+        self.task = None
+        self.version = code_version()
+
+    async def load(self):
+        cached = RESPONSE_CACHE.restore(await self.store.read("response_cache"))
+        rendered_updates = await self.store.read("rendered_updates")
+        if not RENDERED_UPDATES:
+            for slug, record in rendered_updates.items():
+                if not isinstance(record, dict) or record.get("version") != self.version:
+                    continue
+                rendered = RenderedUpdate()
+                rendered.publish(record["messages"])
+                rendered.close()
+                RENDERED_UPDATES[slug] = rendered
+        logger.info(f"Снимок загружен: ответов API {cached}, рендеров {len(RENDERED_UPDATES)}")
+
+    async def save(self):
+        rendered_updates = {
+            slug: {"version": self.version, "messages": rendered.messages}
+            for slug, rendered in RENDERED_UPDATES.items()
+            if rendered.done and not rendered.failed and rendered.error is None
+        }
+        try:
+            await self.store.replace("response_cache", RESPONSE_CACHE.export())
+            await self.store.replace("rendered_updates", rendered_updates)
+        except (sqlite3.Error, TypeError, ValueError):
+            logger.exception("Не удалось сохранить снимок")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.save()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.save()
+
+SNAPSHOT_STORE = SnapshotStore(SNAPSHOT_FILE) if SNAPSHOT_FILE else None
+WARM_SNAPSHOT = WarmSnapshot(SNAPSHOT_STORE, SNAPSHOT_INTERVAL) if SNAPSHOT_STORE else None
+
+METRICS_RUNNER = None
+
+async def post_init(application: Application) -> None:
+    get_http_session()
+    USER_LOG_WRITER.start()
+    if WARM_SNAPSHOT is not None:
+        await WARM_SNAPSHOT.load()
+        WARM_SNAPSHOT.start()
+    await PATCH_HISTORY.load(SNAPSHOT_STORE)
+    RENDER_POOL.start()
+    LOOP_LAG_MONITOR.start()
+    if METRICS_PORT:
+        global METRICS_RUNNER
+        METRICS_RUNNER = await start_metrics_server()
+    SUBSCRIPTIONS.load()
+    if HERO_WARMUP:
+        HERO_STORE.warmup_task = asyncio.create_task(warm_up_hero_store())
+
+async def cancel_tasks(tasks):
+    """Отменяет незавершённые задачи и дожидается их."""
+    tasks = [task for task in tasks if task is not None and not task.done()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def post_shutdown(application: Application) -> None:
+    # Фоновые загрузки останавливаем до закрытия HTTP-клиента, иначе они бы его пересоздали
+    await cancel_tasks(HERO_STORE.pending_tasks() + RESPONSE_CACHE.pending_tasks() + PATCH_HISTORY.pending_tasks())
+    await close_http_session()
+    await USER_LOG_WRITER.stop()
+    if WARM_SNAPSHOT is not None:
+        await WARM_SNAPSHOT.stop()
+        await SNAPSHOT_STORE.close()
+    await LOOP_LAG_MONITOR.stop()
+    RENDER_POOL.stop()
+    if METRICS_RUNNER is not None:
+        await METRICS_RUNNER.cleanup()
+
+# ---------- ОБРАБОТКА ОБНОВЛЕНИЙ ----------
+# Кнопки, повторные нажатия которых склеиваются: меню и inline-кнопки, запускающие запрос и рендер
+DEDUP_TEXT_RE = re.compile(r"Обновления|Ладдер|Герои", re.IGNORECASE)
+DEDUP_CALLBACK_RE = re.compile(r"^(attribute_|hero_|back_to_attributes|ladder_page_|patches$|patch_)")
+
+class ChatOrderedApplication(Application):
+    """Application с параллельной обработкой обновлений разных чатов.
+
+    PTB запускает задачу на каждое обновление (concurrent_updates) и входит в process_update
+    в порядке получения. Здесь обновление сначала встаёт в очередь своего чата — так
+    ConversationHandler видит сообщения чата по порядку, — и только потом занимает один
+    из UPDATE_CONCURRENCY общих слотов. Ожидание попадает в METRICS как ("updates", "queue"):
+    now — глубина очереди, перцентили — время ожидания.
+
+    Ещё до очереди чата отсеиваются повторные нажатия (action_key): дубль присоединяется
+    к обработке той же кнопки, если она последняя в очереди чата. Любое другое обновление
+    между нажатиями (например, «›», «‹», «›» в ладдере) делает повтор настоящим шагом
+    навигации. Кнопки меню, кроме того, отбрасываются в течение DEDUP_WINDOW после
+    обработки, если чат за это время ничего другого не присылал.
+    """
+
+    def __init__(self, concurrency, dedup_window, **kwargs):
+        super().__init__(**kwargs)
+        self.slots = asyncio.Semaphore(concurrency)
+        self.dedup_window = dedup_window
+        # чат → (future, action_key) последнего принятого обновления, пока оно не обработано
+        self.chat_tails = {}
+        # чат → (future, action_key) последней обработанной кнопки меню в пределах DEDUP_WINDOW
+        self.recent_actions = {}
+        self.waiting = 0
+
+    @staticmethod
+    def order_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        # Inline-запросам порядок не нужен, а в очереди личного чата они не успели бы к сроку ответа Telegram
+        if update.inline_query is not None or update.chosen_inline_result is not None:
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return None
+
+    @staticmethod
+    def action_key(update):
+        """(чат, тип, данные) для кнопки, повтор которой можно склеить, иначе None."""
+        if not isinstance(update, Update) or update.effective_chat is None:
+            return None
+        chat_id = update.effective_chat.id
+        if update.callback_query is not None:
+            data = update.callback_query.data
+            if data and DEDUP_CALLBACK_RE.match(data):
+                return chat_id, "callback", data
+        elif update.message is not None and update.message.text:
+            text = update.message.text.strip()
+            if DEDUP_TEXT_RE.fullmatch(text):
+                return chat_id, "text", text.casefold()
+        return None
+
+    @property
+    def backlog(self):
+        """Сколько обновлений получено, но ещё не обрабатывается."""
+        return self.update_queue.qsize() + self.waiting
+
+    async def process_update(self, update):
+        # Дубли и место в очереди чата определяем до первого await, пока порядок входа совпадает с порядком получения
+        action = self.action_key(update)
+        key = self.order_key(update)
+        tail = self.chat_tails.get(key) if key is not None else None
+        if action is not None:
+            if tail is not None and tail[1] == action:
+                await self._skip_duplicate(update, tail[0])
+                return
+            recent = self.recent_actions.get(key)
+            if tail is None and recent is not None and recent[1] == action:
+                await self._skip_duplicate(update, None)
+                return
+        previous = tail[0] if tail is not None else None
+        done = asyncio.get_running_loop().create_future()
+        entry = (done, action)
+        if key is not None:
+            self.chat_tails[key] = entry
+            self.recent_actions.pop(key, None)
+        self.waiting += 1
+        try:
+            with METRICS.track("updates", "queue"):
+                if previous is not None:
+                    # shield: отмена этой задачи не должна отменять future предыдущего обновления
+                    await asyncio.shield(previous)
+                await self.slots.acquire()
+        except BaseException:
+            self.waiting -= 1
+            self._release_turn(key, entry)
+            raise
+        self.waiting -= 1
+        try:
+            with METRICS.track("updates", "process"):
+                await super().process_update(update)
+        finally:
+            self.slots.release()
+            self._release_turn(key, entry)
+
+    def _release_turn(self, key, entry):
+        done, action = entry
+        done.set_result(None)
+        if key is None or self.chat_tails.get(key) is not entry:
+            return
+        del self.chat_tails[key]
+        # Окно после обработки — только для кнопок меню: повтор inline-кнопки может быть шагом навигации
+        if action is not None and action[1] == "text" and self.dedup_window > 0:
+            self.recent_actions[key] = entry
+            asyncio.get_running_loop().call_later(self.dedup_window, self._forget_action, key, entry)
+
+    def _forget_action(self, key, entry):
+        if self.recent_actions.get(key) is entry:
+            del self.recent_actions[key]
+
+    async def _skip_duplicate(self, update, running):
+        METRICS.observe("updates", "duplicate", 0.0)
+        if update.callback_query is not None:
+            # Убираем «часики» на кнопке: ответ придёт из уже идущей обработки
+            try:
+                await update.callback_query.answer()
+            except TelegramError as e:
+                logger.debug(f"Не удалось ответить на повторное нажатие: {e}")
+        if running is not None:
+            await asyncio.shield(running)
+
+def build_application() -> Application:
+    builder = (
+        Application.builder()
+        .application_class(
+            ChatOrderedApplication,
+            kwargs={"concurrency": UPDATE_CONCURRENCY, "dedup_window": DEDUP_WINDOW},
+        )
+        .concurrent_updates(UPDATE_PENDING_LIMIT)
+        .token(TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .rate_limiter(SendScheduler())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if SNAPSHOT_STORE is not None:
+        builder = builder.persistence(SnapshotPersistence(SNAPSHOT_STORE))
+    application = builder.build()
+
+    menu_buttons = [
+        (re.compile(r"Обновления", re.IGNORECASE), handle_updates_button),
+        (re.compile(r"Ладдер", re.IGNORECASE), handle_leaderboard_button),
+        (re.compile(r"Герои", re.IGNORECASE), handle_heroes_button),
+    ]
+    menu_filter = filters.Regex(re.compile(r"Обновления|Ладдер|Герои", re.IGNORECASE))
 
+    # Кнопки меню во время ввода Dota ID не считаются ID: диалог завершается и кнопка срабатывает
     conv_handler = ConversationHandler(
         entry_points=[MessageHandler(filters.Regex(re.compile(r"Проверить статистику", re.IGNORECASE)), start_dota_stats)],
         states={
-            GET_DOTA_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_dota_id)],
+            GET_DOTA_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND & ~menu_filter, get_dota_id)],
         },
-        fallbacks=[CommandHandler("cancel", cancel_dota_stats)],
+        fallbacks=[CommandHandler("cancel", cancel_dota_stats)] + [
+            MessageHandler(filters.Regex(pattern), leaving_dota_stats(callback)) for pattern, callback in menu_buttons
+        ],
+        name="dota_stats",
+        persistent=SNAPSHOT_STORE is not None,
     )
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("hero", hero_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CommandHandler("patches", handle_patches_list))
+    application.add_handler(CommandHandler("cachestats", cache_stats_command))
+    application.add_handler(CommandHandler("metrics", metrics_command))
+    application.add_handler(CommandHandler("subscribe", subscribe_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
     application.add_handler(conv_handler)
-    application.add_handler(MessageHandler(filters.Regex(re.compile(r"Обновления", re.IGNORECASE)), handle_updates_button))
-    application.add_handler(MessageHandler(filters.Regex(re.compile(r"Ладдер", re.IGNORECASE)), handle_leaderboard_button))
-    application.add_handler(MessageHandler(filters.Regex(re.compile(r"Герои", re.IGNORECASE)), handle_heroes_button))
+    for pattern, callback in menu_buttons:
+        application.add_handler(MessageHandler(filters.Regex(pattern), callback))
     application.add_handler(CallbackQueryHandler(handle_attribute_selection, pattern=r"^attribute_"))
     application.add_handler(CallbackQueryHandler(handle_hero_selection, pattern=r"^hero_"))
     application.add_handler(CallbackQueryHandler(handle_heroes_button, pattern="^back_to_attributes"))
+    application.add_handler(CallbackQueryHandler(handle_ladder_page, pattern=r"^ladder_"))
+    application.add_handler(CallbackQueryHandler(handle_patches_list, pattern=r"^patches$"))
+    application.add_handler(CallbackQueryHandler(handle_patch_selection, pattern=r"^patch_"))
+    application.add_handler(InlineQueryHandler(handle_inline_query))
+    # Последним: остальной текст в личке — поиск героя
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE, handle_hero_search))
+
+    instrument_handlers(application)
+
+    if application.job_queue is None:
+        logger.warning(
+            "JobQueue недоступен (нужен python-telegram-bot[job-queue]), слежение за патчами выключено, "
+            "история патчей пополняется только из обработчиков"
+        )
+    else:
+        # История нужна каждой реплике, рассылка — только одной
+        application.job_queue.run_repeating(
+            instrumented(sync_patch_history, kind="job"), interval=PATCH_WATCH_INTERVAL, first=5
+        )
+        if PATCH_WATCHER:
+            application.job_queue.run_repeating(
+                instrumented(check_for_new_patch, kind="job"), interval=PATCH_WATCH_INTERVAL, first=10
+            )
+        else:
+            logger.info("PATCH_WATCHER=0: слежение за патчами и рассылка на этой реплике выключены")
+
+    return application
+
+# ---------- WEBHOOK ----------
+async def webhook_handler(request):
+    application = request.app["application"]
+    # Сравнение за постоянное время: по задержке ответа секрет не подобрать
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+        return web.Response(status=403)
+    # Очередь переполнена: Telegram повторит доставку позже
+    if application.backlog >= WEBHOOK_MAX_QUEUE:
+        METRICS.observe("webhook", "rejected", 0.0, error=True)
+        return web.Response(status=503, headers={"Retry-After": "1"})
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    if not isinstance(data, dict):
+        return web.Response(status=400)
+    try:
+        update = Update.de_json(data, application.bot)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return web.Response(status=400)
+    if update is None:
+        return web.Response(status=400)
+    await application.update_queue.put(update)
+    return web.Response()
+
+async def health_handler(request):
+    application = request.app["application"]
+    return web.json_response({
+        "status": "ok" if application.running else "starting",
+        "queue": application.backlog,
+    })
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+async def run_webhook(application: Application) -> None:
+    """Принимает обновления через aiohttp-сервер вместо long polling.
+
+    Для локальной проверки без регистрации вебхука в Telegram:
+        BOT_MODE=webhook WEBHOOK_SET=0 WEBHOOK_SECRET=test python bot.py
+        curl -X POST -H "X-Telegram-Bot-Api-Secret-Token: test" \\
+             -H "Content-Type: application/json" -d @update.json localhost:8080/telegram
+    """
+    web_app = web.Application()
+    web_app["application"] = application
+    web_app.router.add_post(WEBHOOK_PATH, webhook_handler)
+    web_app.router.add_get("/healthz", health_handler)
+    runner = web.AppRunner(web_app, access_log=None)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        if WEBHOOK_SET:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await application.start()
+        logger.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def main() -> None:
+    # Без секрета эндпоинт вебхука принял бы поддельные обновления от кого угодно
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        logger.critical("BOT_MODE=webhook требует WEBHOOK_SECRET")
+        raise SystemExit(1)
+    application = build_application()
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
 
 if __name__ == "__main__":
     main()